@@ -1,5 +1,3 @@
-import pydot
-
 ###########################################
 # DesSine AST
 # Made by Pierre Bürki and Loïck Jeanneret
@@ -10,29 +8,30 @@ import pydot
 class Node:
     """
     Same as the file used in all the course's exercises,
-    with the added field of the line number
+    with the added field of the line number.
+    Nodes have slots instead of a __dict__, as long programs have millions of them: each class
+    declares the slots of the fields it adds.
     """
-    count = 0
+    __slots__ = ("lineno", "children")
     type = 'Node (unspecified)'
     shape = 'ellipse'
 
     def __init__(self, lineno, children=None):
-        self.ID = str(Node.count)
         self.lineno = lineno
 
-        Node.count += 1
-
+        # Nodes without children share the same empty tuple
         if not children:
-            self.children = []
+            self.children = ()
         elif hasattr(children, '__len__'):
             self.children = children
         else:
             self.children = [children]
 
-        self.next = []
-
-    def addNext(self, next):
-        self.next.append(next)
+    def fields(self):
+        """
+        Returns the fields of the node by name, children and line number included
+        """
+        return {name: getattr(self, name) for cls in type(self).__mro__ for name in getattr(cls, "__slots__", ())}
 
     def asciitree(self, prefix=''):
         result = "%s%s\n" % (prefix, repr(self))
@@ -53,15 +52,19 @@ class Node:
         return self.type
 
     def makegraphicaltree(self, dot=None, edgeLabels=True):
+        # Only needed to draw the tree, not to run programs
+        import pydot
+
         if not dot:
             dot = pydot.Dot()
 
-        dot.add_node(pydot.Node(self.ID, label=repr(self), shape=self.shape))
+        # Nodes have no ID of their own, their identity is only needed while the graph is made
+        dot.add_node(pydot.Node(str(id(self)), label=repr(self), shape=self.shape))
         label = edgeLabels and len(self.children)-1
 
         for i, c in enumerate(self.children):
             c.makegraphicaltree(dot, edgeLabels)
-            edge = pydot.Edge(self.ID, c.ID)
+            edge = pydot.Edge(str(id(self)), str(id(c)))
             if label:
                 edge.set_label(str(i))
             dot.add_edge(edge)
@@ -75,25 +78,39 @@ class ProgramNode(Node):
     Root of the syntaxic tree.
     Has two children : the init block and the body
     """
+    __slots__ = ("frame",)
     type = 'Program'
 
+    def __init__(self, lineno, children):
+        Node.__init__(self, lineno, children)
+        # Set by the resolver: initial frame of the program's variables
+        self.frame = None
+
 
 class BodyNode(Node):
     """
     Node whose children are a succession of statements
     """
+    __slots__ = ()
     type = 'Body'
 
 class BlockNode(Node):
     """
     Node representing a body surrounded by brackets, changes scope
     """
+    __slots__ = ("frame",)
     type = 'Block'
 
+    def __init__(self, lineno, children):
+        Node.__init__(self, lineno, children)
+        # Set by the resolver: initial frame of the block's variables, None if it declares none
+        self.frame = None
+
 class InitBlockNode(Node):
     """
     Block whose children are a succession of InitNode, it must exist once at the start of the program
     """
+    __slots__ = ()
     type = 'InitBlock'
 
 
@@ -101,17 +118,21 @@ class InitNode(Node):
     """
     Child of the InitBlockNode. Each one comprises of a call to an init function.
     """
+    __slots__ = ("action", "method")
     type = "Init"
 
     def __init__(self, lineno, action, children):
         Node.__init__(self, lineno, children)
         self.action = action
+        # Set by the resolver: method of the built-in
+        self.method = None
 
     def __repr__(self):
         return self.action
 
 
 class RoutineDefinitionNode(Node):
+    __slots__ = ("name", "params", "block", "layout")
     type = 'Routine Definition'
 
     def __init__(self, lineno, name, params, block):
@@ -119,23 +140,33 @@ class RoutineDefinitionNode(Node):
         self.name = name
         self.params = list(map(lambda tokenNode: tokenNode.tok, params))
         self.block = block
+        # Set by the resolver: layout of the parameters' frame, None if there are no parameters
+        self.layout = None
     
     def __repr__(self):
         return f"{self.name}({self.params})"
 
+    def asciitree(self, prefix=''):
+        # The block is not a child, but it is part of the routine's tree
+        return Node.asciitree(self, prefix) + self.block.asciitree(prefix + '|  ')
+
 
 class RoutineCallNode(Node):
+    __slots__ = ("name", "routine")
     type = 'Routine Call'
 
     def __init__(self, lineno, name, params):
         Node.__init__(self, lineno, params)
         self.name = name
+        # Set by the resolver: definition of the routine, if there is only one
+        self.routine = None
 
 
 class ComparisonNode(Node):
     """
     Node that will yields true / false when evaluated
     """
+    __slots__ = ("operator",)
     type = 'Comparison'
 
     def __init__(self, lineno, operator, children):
@@ -147,64 +178,66 @@ class ComparisonNode(Node):
 
 
 class TokenNode(Node):
+    __slots__ = ("tok", "value", "depth", "slot")
     type = 'token'
 
     def __init__(self, lineno, tok):
         Node.__init__(self, lineno)
         self.tok = tok
-        self.assign = False
+        # Set by the resolver: value of literals and constants, frame depth and slot of variables
+        self.value = None
+        self.depth = None
+        self.slot = None
 
     def __repr__(self):
         return repr(self.tok)
 
 
 class OpNode(Node):
+    __slots__ = ("op",)
+
     def __init__(self, lineno, op, children):
         Node.__init__(self, lineno, children)
         self.op = op
-        try:
-            self.nbargs = len(children)
-        except AttributeError:
-            self.nbargs = 1
 
     def __repr__(self):
-        return "%s (%s)" % (self.op, self.nbargs)
+        return "%s (%s)" % (self.op, len(self.children))
 
 
 class AssignNode(Node):
+    __slots__ = ()
     type = '='
 
 
 class IfNode(Node):
+    __slots__ = ()
     type = 'if'
 
 
 class WhileNode(Node):
+    __slots__ = ()
     type = 'while'
 
 
 class ForNode(Node):
+    __slots__ = ()
     type = 'for'
 
 
 class FunctionNode(Node):
+    __slots__ = ("action", "method")
     type = 'Function'
 
     def __init__(self, lineno, action, arguments):
         Node.__init__(self, lineno, arguments)
         self.action = action
+        # Set by the resolver: method of the built-in
+        self.method = None
 
     def __repr__(self):
         return self.action
 
 
-class EntryNode(Node):
-    type = 'ENTRY'
-
-    def __init__(self, lineno):
-        Node.__init__(self, lineno, None)
-
-
 def addToClass(cls):
     '''
     Copied from the decorator used in the course's exercises
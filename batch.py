@@ -0,0 +1,221 @@
+from collections import namedtuple
+import glob, os, shlex, sys, time
+from limits import default_depth, limit_status
+import multiprocessing
+from multiprocessing.connection import wait
+
+import logger
+
+###########################################
+# DesSine batch renderer
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# Every program is rendered in a process of its own, so that it can be killed, and so that its
+# output (and crashes) stay apart from the others'. At most --jobs of them run at once.
+# Everything a program prints goes to a log file next to its drawing.
+#
+# A program running out of time is stopped by the interpreter itself (see limits.py), which still
+# outputs what it has drawn so far. The process is only killed if it has not exited grace seconds
+# later, e.g. because rendering the drawing takes too long.
+
+# Seconds given to a process after its timeout before it is killed
+grace = 5
+
+Job = namedtuple("Job", ["path", "output", "log"])
+Result = namedtuple("Result", ["path", "status", "parse", "execute", "segments"])
+
+
+def collect_files(inputs, list_file=None):
+    """
+    Returns the .ds files designated by the given paths, directories (searched recursively)
+    and glob patterns, followed by the ones listed in list_file (one per line, - for stdin)
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files += sorted(glob.glob(os.path.join(item, "**", "*.ds"), recursive=True))
+        elif glob.has_magic(item):
+            files += sorted(glob.glob(item, recursive=True))
+        else:
+            files.append(item)
+
+    if list_file:
+        with (sys.stdin if list_file == "-" else open(list_file)) as f:
+            files += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    return files
+
+
+def make_jobs(files, output_dir, extension):
+    """
+    Names the drawing and the log of each file after it, numbering the files sharing a name
+    """
+    jobs = []
+    taken = set()
+    for path in files:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name = stem
+        n = 1
+        while name in taken:
+            n += 1
+            name = f"{stem}-{n}"
+        taken.add(name)
+        jobs.append(Job(path, os.path.join(output_dir, name + extension), os.path.join(output_dir, name + ".log")))
+    return jobs
+
+
+def render(job, options, connection):
+    """
+    Renders a single file, in its own process, and sends its timings back through the connection
+    """
+    # Everything the interpreter prints goes to the job's log
+    log = open(job.log, "w")
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+
+    import interpreter
+
+    # The format of the drawing is told by its extension, e.g. --png for .png
+    output = ["--" + os.path.splitext(job.output)[1][1:], job.output]
+
+    context = interpreter.RenderContext()
+    status = 0
+    try:
+        interpreter.main([job.path] + output + options, context)
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        connection.send((context.phases, len(context.segments)))
+
+    sys.exit(status)
+
+
+def run_batch(jobs, options, workers, timeout):
+    """
+    Renders the jobs with at most workers processes at once, killing the ones still running
+    grace seconds after their timeout, and returns their results in the order of the jobs
+    """
+    # Building the parser's tables once here spares the workers from doing it
+    import dessine_parser
+
+    pending = list(reversed(jobs))
+    running = {}
+    results = {}
+
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.pop()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=render, args=(job, options, sender), daemon=True)
+            process.start()
+            sender.close()
+            running[process.sentinel] = (job, process, receiver, time.monotonic() + timeout + grace)
+
+        deadline = min(entry[3] for entry in running.values())
+        wait(list(running), timeout=max(0, deadline - time.monotonic()))
+
+        now = time.monotonic()
+        for sentinel, (job, process, receiver, deadline) in list(running.items()):
+            if process.is_alive() and now < deadline:
+                continue
+
+            timed_out = process.is_alive()
+            if timed_out:
+                process.kill()
+            process.join()
+
+            if timed_out:
+                status = "timeout"
+            elif process.exitcode == 0:
+                status = "ok"
+            elif process.exitcode == limit_status:
+                # The log tells which limit was reached
+                status = "limit"
+            elif process.exitcode > 0:
+                status = f"error ({process.exitcode})"
+            else:
+                status = f"killed ({-process.exitcode})"
+
+            # Killed processes could not send anything
+            try:
+                phases, count = receiver.recv()
+            except EOFError:
+                phases, count = {}, None
+            receiver.close()
+            parse = phases["parse"] + phases.get("resolve", 0) if "parse" in phases else None
+            results[job] = Result(job.path, status, parse, phases.get("execute"), count)
+            del running[sentinel]
+
+    return [results[job] for job in jobs]
+
+
+def print_summary(results, elapsed):
+    """
+    Prints a table of the results, with one row per file
+    """
+    def seconds(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    rows = [("File", "Status", "Parse (s)", "Exec (s)", "Segments")]
+    rows += [(r.path, r.status, seconds(r.parse), seconds(r.execute), "-" if r.segments is None else str(r.segments))
+             for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+
+    for row in rows:
+        print("  ".join(cell.ljust(w) if i < 2 else cell.rjust(w) for i, (cell, w) in enumerate(zip(row, widths))))
+
+    failed = sum(r.status != "ok" for r in results)
+    print(f"\n{len(results)} files, {failed} failed, in {elapsed:.1f}s")
+
+
+def parse_arguments(argv):
+    """
+    Parses the command line arguments of the batch renderer
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Renders many DesSine programs in parallel, without window")
+    parser.add_argument("inputs", nargs="*", help=".ds files, directories or glob patterns")
+    parser.add_argument("--list", metavar="FILE", help="file listing the .ds files to render, one per line (- for stdin)")
+    parser.add_argument("--output-dir", default="renders", help="directory the drawings and logs are written to")
+    parser.add_argument("--format", choices=["png", "svg"], default="png", help="format of the drawings")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of programs rendered at once")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds after which a program is stopped (and killed if it does not exit)")
+    parser.add_argument("--options", default="",
+                        help="more options for the interpreter, e.g. --options=\"--engine closure --memoize\"")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    files = collect_files(args.inputs, args.list)
+    if not files:
+        logger.error("Batch error", "-", "No .ds file to render.")
+        sys.exit(-1)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = make_jobs(files, args.output_dir, "." + args.format)
+    start = time.monotonic()
+    options = shlex.split(args.options)
+    if "--max-time" not in options:
+        options += ["--max-time", str(args.timeout)]
+    if "--max-depth" not in options:
+        options += ["--max-depth", str(default_depth)]
+    results = run_batch(jobs, options, args.jobs, args.timeout)
+
+    print_summary(results, time.monotonic() - start)
+    if any(r.status != "ok" for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
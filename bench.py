@@ -0,0 +1,358 @@
+from collections import namedtuple
+import json, os, subprocess, sys, tempfile
+
+import logger
+
+###########################################
+# DesSine benchmarks
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# The benchmarks are variants of the example programs, made bigger by replacing the constant
+# which sets their recursion depth or number of iterations. Each variant is run in a process of
+# its own for every backend (and engine), which reports the time of each phase and its peak
+# memory, and once more with the profiler to count the statements it executes.
+#
+# Results can be saved as a baseline, and later runs compared with it: any phase slower than the
+# baseline by more than the tolerance is reported as a regression.
+#
+# The scaling benchmark (--scaling) parses generated programs from a thousand to a million
+# statements long, in a long body, a long init block or a long list of arguments. Parsing has to
+# take the same time per statement whatever the length of the program.
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# pattern is replaced by template.format(size) in the example
+Workload = namedtuple("Workload", ["name", "path", "pattern", "template", "sizes"])
+
+workloads = [
+    # Threshold of the recursion: depth 3, 5 and 7
+    Workload("koch", "dscripts/examples/koch.ds", "length < 9", "length < {}",
+             {"small": 9, "medium": 1, "large": 0.1}),
+    Workload("sierpinski", "dscripts/examples/sierpinski.ds", "step(5)", "step({})",
+             {"small": 5, "medium": 6, "large": 8}),
+    # Number of turns, by steps of 0.001
+    Workload("spiral", "dscripts/examples/spiral.ds", "i < 180", "i < {}",
+             {"small": 5, "medium": 20, "large": 180}),
+    Workload("triangles", "dscripts/examples/triangles.ds", "i < 0x1000", "i < {}",
+             {"small": 0x1000, "medium": 0x4000, "large": 0x40000}),
+]
+
+# Command line options of the interpreter for each backend, OUTPUT being replaced by a file
+backends = {
+    "png": ["--png", "OUTPUT.png"],
+    "svg": ["--svg", "OUTPUT.svg"],
+    "js": ["js", "--js-format", "binary"],
+    "js-text": ["js"],
+}
+
+phase_names = ("lex", "parse", "resolve", "execute", "output")
+
+# Number of statements of the programs of the scaling benchmark
+scaling_counts = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+
+# Generated programs of the scaling benchmark, by the part made long
+shapes = {
+    "body": lambda count: "#width(100)\n#height(100)\n" + "draw()\nrotate(0.1)\nmove()\n" * (count // 3),
+    "init": lambda count: "#width(100)\n" * count + "draw()\n",
+    "arguments": lambda count: "#width(100)\n#height(100)\nlog(" + ", ".join(["1"] * count) + ")\n",
+}
+
+
+def variant(workload, size):
+    """
+    Returns the source of the workload at the given size
+    """
+    with open(os.path.join(here, workload.path)) as f:
+        source = f.read()
+
+    if workload.pattern not in source:
+        logger.error("Benchmark error", "-", f"'{workload.pattern}' not found in {workload.path}")
+        sys.exit(-1)
+    return source.replace(workload.pattern, workload.template.format(workload.sizes[size]))
+
+
+def measure(path, options, count):
+    """
+    Runs a program and returns its measures. Called in a process of its own by run_one, so that
+    the peak memory is the one of this program alone.
+    """
+    from time import perf_counter
+    import resource
+    import lex, dessine_parser, interpreter
+
+    with open(path) as f:
+        source = f.read()
+
+    # Lexing on its own, on a copy of the lexer so that the line numbers of the parser are right
+    lexer = lex.lexer.clone()
+    start = perf_counter()
+    lexer.input(source)
+    tokens = 0
+    while lexer.token():
+        tokens += 1
+    lexing = perf_counter() - start
+
+    # Lexing is done again by the parser, its time is taken off
+    start = perf_counter()
+    ast = dessine_parser.parse(source)
+    parsing = perf_counter() - start - lexing
+
+    profile = os.path.join(os.path.dirname(path), "profile.json")
+    args = interpreter.parse_arguments([path] + options + (["--profile-json", profile] if count else []))
+    context = interpreter.run_program(source, args, tree=ast)
+
+    result = dict(context.phases, lex=lexing, parse=parsing, tokens=tokens, segments=len(context.segments))
+
+    if count:
+        # Statements are the nodes which are not part of an expression
+        import profiler
+        with open(profile) as f:
+            nodes = json.load(f)["nodes"]
+        result["statements"] = sum(node["count"] for kind, node in nodes.items()
+                                   if kind not in (cls.__name__ for cls in profiler.expressions))
+
+    # Kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss"] = rss / 1024 if sys.platform != "darwin" else rss / 1024 / 1024
+    return result
+
+
+def measure_parse(path):
+    """
+    Parses a program and returns the time it took and the peak memory. Called in a process of its
+    own, like measure.
+    """
+    from time import perf_counter
+    import resource
+    import dessine_parser
+
+    with open(path) as f:
+        source = f.read()
+
+    start = perf_counter()
+    dessine_parser.parse(source)
+    parsing = perf_counter() - start
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"parse": parsing, "peak_rss": rss / 1024 if sys.platform != "darwin" else rss / 1024 / 1024}
+
+
+def run_scaling(counts, repeat, timeout):
+    """
+    Parses the generated programs of each shape and number of statements, repeat times, keeping
+    the fastest time. Returns {key: measures}.
+    """
+    results = {}
+    print(f"{'benchmark':<32}{'parse (ms)':>14}{'us/statement':>14}{'peak RSS (MB)':>15}")
+    with tempfile.TemporaryDirectory() as directory:
+        for shape, generate in shapes.items():
+            for count in counts:
+                path = os.path.join(directory, f"{shape}-{count}.ds")
+                with open(path, "w") as f:
+                    f.write(generate(count))
+
+                command = [sys.executable, os.path.abspath(__file__), "--measure-parse", path]
+                runs = []
+                for _ in range(repeat):
+                    try:
+                        process = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+                    except subprocess.TimeoutExpired:
+                        break
+                    if process.returncode == 0:
+                        runs.append(json.loads(process.stdout.splitlines()[-1]))
+
+                key = f"parse/{shape}/{count}"
+                if not runs:
+                    logger.warning("Benchmark", f"{key} failed or timed out")
+                    continue
+                best = {"parse": min(r["parse"] for r in runs), "peak_rss": max(r["peak_rss"] for r in runs),
+                        "statements": count}
+                results[key] = best
+                print(f"{key:<32}{best['parse'] * 1000:>14.2f}{best['parse'] / count * 1e6:>14.3f}"
+                      f"{best['peak_rss']:>15.1f}")
+    return results
+
+
+def check_scaling(results, tolerance):
+    """
+    Reports the shapes whose time per statement grows by more than tolerance (e.g. 2 for 200%)
+    from the shortest program to the longest one, and returns how many there are
+    """
+    regressions = 0
+    for shape in shapes:
+        measured = sorted((m["statements"], m["parse"] / m["statements"]) for key, m in results.items()
+                          if key.startswith(f"parse/{shape}/"))
+        if len(measured) < 2:
+            continue
+        (shortest, before), (longest, after) = measured[0], measured[-1]
+        if after > before * (1 + tolerance):
+            logger.warning("Regression", f"parsing is not linear ({shape}): {before * 1e6:.3f} us/statement "
+                                         f"for {shortest} statements, {after * 1e6:.3f} for {longest}")
+            regressions += 1
+    return regressions
+
+
+def run_one(path, options, count, timeout):
+    """
+    Measures a program in a new process, whose working directory is the one of the program
+    (the js backend always writes drawing.js in the working directory)
+    """
+    directory = os.path.dirname(path)
+    options = [option.replace("OUTPUT", os.path.join(directory, "output")) for option in options]
+    command = [sys.executable, os.path.abspath(__file__), "--measure", path, "--count" if count else "--no-count",
+               "--"] + options
+
+    try:
+        process = subprocess.run(command, cwd=directory, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+
+    if process.returncode != 0:
+        logger.warning("Benchmark", f"{' '.join(options)} failed:\n{process.stdout}{process.stderr}")
+        return None
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def run_benchmarks(sizes, backends_used, engines, repeat, timeout):
+    """
+    Runs every workload at each size, with each backend and engine, repeat times,
+    keeping the fastest time of each phase. Returns {key: measures}.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for workload in workloads:
+            for size in sizes:
+                path = os.path.join(directory, f"{workload.name}-{size}.ds")
+                with open(path, "w") as f:
+                    f.write(variant(workload, size))
+
+                # The statements do not depend on the backend nor the engine, they are counted once
+                counted = run_one(path, backends["svg"], True, timeout)
+
+                for backend in backends_used:
+                    for engine in engines:
+                        key = f"{workload.name}/{size}/{backend}/{engine}"
+                        runs = [run_one(path, backends[backend] + ["--engine", engine], False, timeout)
+                                for _ in range(repeat)]
+                        runs = [r for r in runs if r is not None]
+                        if not runs:
+                            logger.warning("Benchmark", f"{key} failed or timed out")
+                            continue
+
+                        best = {phase: min(r.get(phase, 0) for r in runs) for phase in phase_names}
+                        best["segments"] = runs[0]["segments"]
+                        best["peak_rss"] = max(r["peak_rss"] for r in runs)
+                        best["statements"] = counted["statements"] if counted else None
+                        results[key] = best
+                        print_row(key, best)
+    return results
+
+
+def print_header():
+    print(f"{'benchmark':<32}" + "".join(f"{phase + ' (ms)':>14}" for phase in phase_names)
+          + f"{'statements/s':>14}{'segments/s':>14}{'peak RSS (MB)':>15}")
+
+
+def print_row(key, measures):
+    execute = measures["execute"] or float("nan")
+    drawing = measures["execute"] + measures["output"] or float("nan")
+    statements = f"{measures['statements'] / execute:>14.0f}" if measures["statements"] else f"{'-':>14}"
+    print(f"{key:<32}" + "".join(f"{measures[phase] * 1000:>14.2f}" for phase in phase_names)
+          + statements + f"{measures['segments'] / drawing:>14.0f}{measures['peak_rss']:>15.1f}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Reports the phases slower than in the baseline by more than tolerance (e.g. 0.1 for 10%),
+    and returns how many there are. Phases too short to be measured reliably are ignored.
+    """
+    regressions = 0
+    for key, measures in results.items():
+        if key not in baseline:
+            continue
+        for phase in phase_names:
+            before = baseline[key].get(phase, 0)
+            after = measures[phase]
+            if before > 0.005 and after > before * (1 + tolerance):
+                logger.warning("Regression", f"{key} {phase}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms "
+                                             f"(+{after / before - 1:.0%})")
+                regressions += 1
+    return regressions
+
+
+def parse_arguments(argv):
+    """
+    Parses the command line arguments of the benchmarks
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the DesSine interpreter and backends")
+    parser.add_argument("--sizes", default="small,medium", help="sizes of the workloads: small, medium, large")
+    parser.add_argument("--backends", default="svg,png", help=f"backends to measure: {', '.join(backends)}")
+    parser.add_argument("--engines", default="tree", help="engines to measure: tree, closure, stack")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark, the fastest one is kept")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds after which a run is given up")
+    parser.add_argument("--save", metavar="FILE", help="write the results to a JSON file, to be used as baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results with the ones of a JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown over the baseline reported as a regression (0.1 is 10%%)")
+    parser.add_argument("--scaling", action="store_true",
+                        help="measure the parser on generated programs of 10^3 to 10^6 statements instead, and "
+                             "fail if its time per statement grows by more than --scaling-tolerance")
+    parser.add_argument("--scaling-counts", default=",".join(map(str, scaling_counts)),
+                        help="numbers of statements of the scaling benchmark")
+    parser.add_argument("--scaling-tolerance", type=float, default=2,
+                        help="growth of the time per statement reported as not linear (2 is 200%%)")
+    # Used by run_one to measure a single program in a new process
+    parser.add_argument("--measure", metavar="FILE", help=argparse.SUPPRESS)
+    parser.add_argument("--count", action=argparse.BooleanOptionalAction, default=False, help=argparse.SUPPRESS)
+    parser.add_argument("--measure-parse", metavar="FILE", help=argparse.SUPPRESS)
+    parser.add_argument("options", nargs="*", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    if args.measure:
+        result = measure(args.measure, args.options, args.count)
+        print(json.dumps(result))
+        return
+
+    if args.measure_parse:
+        print(json.dumps(measure_parse(args.measure_parse)))
+        return
+
+    if args.scaling:
+        results = run_scaling([int(count) for count in args.scaling_counts.split(",")], args.repeat, args.timeout)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        regressions = check_scaling(results, args.scaling_tolerance)
+        if regressions:
+            sys.exit(1)
+        logger.info("Benchmark", "Parsing is linear in the number of statements")
+        return
+
+    print_header()
+    results = run_benchmarks(args.sizes.split(","), args.backends.split(","), args.engines.split(","),
+                             args.repeat, args.timeout)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            logger.warning("Benchmark", f"{regressions} regressions over {args.baseline}")
+            sys.exit(1)
+        logger.info("Benchmark", f"No regression over {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import hashlib, os, pickle, threading
+
+###########################################
+# DesSine cache
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# The lexer and parser tables, and the trees of the programs already parsed, are kept in a
+# cache directory: $DESSINE_CACHE if set, otherwise dessine in the user's cache directory.
+# Every file of the cache is named after a hash of what it was generated from, so that it is
+# never stale and can be loaded without checking it again.
+
+# Modules whose code determines the tables and the trees
+sources = ("lex.py", "dessine_parser.py", "AST.py", "flattree.py")
+
+
+def cache_dir():
+    """
+    Returns the cache directory, created if needed, or None if it cannot be written to
+    """
+    path = os.environ.get("DESSINE_CACHE")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "dessine")
+
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    return path if os.access(path, os.W_OK) else None
+
+
+def source_hash(*contents):
+    """
+    Returns a short hash of the given contents, along with the code of the DesSine modules
+    """
+    digest = hashlib.sha1()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in sources:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(f.read())
+    for content in contents:
+        digest.update(content)
+    return digest.hexdigest()[:16]
+
+
+def table_path(name, extension):
+    """
+    Returns the path of the given table in the cache, or None if there is no cache
+    """
+    directory = cache_dir()
+    if directory is None:
+        return None
+
+    from ply import __version__
+    return os.path.join(directory, f"{name}_{source_hash(__version__.encode())}{extension}")
+
+
+def load_module(path):
+    """
+    Loads a python file of the cache as a module, without adding the cache to the import path
+    """
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse(program):
+    """
+    Returns the tree of the given program, parsed by dessine_parser. Trees are cached by hash of
+    the program, and the parser (and PLY with it) is not even imported when the tree is cached.
+    Trees are cached as parsed, before any other pass sets their attributes, as flat trees
+    (see flattree.py).
+    """
+    from flattree import encode, decode
+
+    directory = cache_dir()
+    path = None
+    if directory is not None:
+        path = os.path.join(directory, "ast", source_hash(program.encode()) + ".pickle")
+        try:
+            with open(path, "rb") as f:
+                return decode(pickle.load(f))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+    from dessine_parser import parse
+    tree = parse(program)
+
+    if path is not None:
+        # Written under a temporary name first, so that concurrent runs never read half a file
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temporary, "wb") as f:
+                pickle.dump(encode(tree), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+        except (OSError, pickle.PicklingError):
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    return tree
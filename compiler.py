@@ -0,0 +1,352 @@
+import AST
+from AST import addToClass
+from collections import namedtuple
+
+from errors import DesSineError
+from limits import weight
+from resolver import UNSET, lookup, assign
+
+###########################################
+# DesSine closure compiler
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# The closure engine walks the resolved tree only once: every node is turned into a python
+# closure in which operators, comparators, built-ins and variable slots are already resolved.
+# Running the program is then a matter of calling the closure of the body, without any
+# per-node dispatch.
+
+# Everything the compiled closures need from the interpreter, memoizer and limits are None
+# unless enabled. Loops and calls only check the limits if there are any.
+Environment = namedtuple("Environment", ["frames", "operators", "comparators", "memoizer", "limits"],
+                         defaults=[None, None])
+
+
+class Routines:
+    """
+    Compiled routines of a program. Each definition gets a cell, filled once its block is
+    compiled, so that (recursive) calls can be compiled before the routine they call.
+    """
+
+    def __init__(self):
+        self.cells = {}
+        # Definitions run so far, by name, for the routines defined several times
+        self.defined = {}
+
+    def cell(self, definition):
+        return self.cells.setdefault(definition, [None])
+
+
+def compile_program(program, env):
+    """
+    Compiles the body of the given ProgramNode and returns a closure executing it.
+    The init block is not compiled, as it is run once by the interpreter before the body.
+    """
+    return program.children[1].compile(env, Routines())
+
+
+def compile_statements(nodes, env, routines):
+    """
+    Compiles a list of statements into a single closure running them in order
+    """
+    statements = tuple(c.compile(env, routines) for c in nodes)
+
+    if len(statements) == 1:
+        return statements[0]
+
+    def run():
+        for statement in statements:
+            statement()
+    return run
+
+
+@addToClass(AST.BodyNode)
+def compile(self, env, routines):
+    return compile_statements(self.children, env, routines)
+
+
+@addToClass(AST.BlockNode)
+def compile(self, env, routines):
+    body = compile_statements(self.children, env, routines)
+
+    # Blocks declaring no variable do not need a frame
+    if self.frame is None:
+        return body
+
+    frames = env.frames
+    frame = self.frame
+
+    def run():
+        frames.append(frame.copy())
+        body()
+        frames.pop()
+    return run
+
+
+@addToClass(AST.RoutineDefinitionNode)
+def compile(self, env, routines):
+    routines.cell(self)[0] = self.block.compile(env, routines)
+    defined = routines.defined
+    name = self.name
+
+    def run():
+        defined[name] = self
+    return run
+
+
+@addToClass(AST.RoutineCallNode)
+def compile(self, env, routines):
+    call = compile_call(self, env, routines)
+    if env.limits is None:
+        return call
+
+    limits = env.limits
+    lineno = self.lineno
+    statements = weight(self.routine.block) if self.routine is not None else 1
+
+    def run():
+        limits.enter(lineno, statements)
+        call()
+        limits.depth -= 1
+    return run
+
+
+def compile_call(node, env, routines):
+    """
+    Compiles a call to a routine, see RoutineCallNode.compile
+    """
+    name = node.name
+    lineno = node.lineno
+    frames = env.frames
+    arguments = tuple(c.compile(env, routines) for c in node.children)
+
+    # Calls linked by the resolver jump straight to the compiled block of their routine
+    if node.routine is not None:
+        cell = routines.cell(node.routine)
+        layout = node.routine.layout
+
+        if env.memoizer is not None:
+            return compile_memoized_call(node.routine, arguments, cell, env)
+
+        if layout is None:
+            return lambda: cell[0]()
+
+        def run():
+            frames.append([layout] + [argument() for argument in arguments])
+            cell[0]()
+            frames.pop()
+        return run
+
+    def run():
+        # Routines defined several times can only be looked up when called
+        routine = routines.defined.get(name)
+        if routine is None:
+            raise DesSineError("Semantic error", lineno, f"No function with name '{name}' exists.")
+
+        if len(routine.params) != len(arguments):
+            raise DesSineError("Semantic error", lineno, f"Bad number of arguments in '{name}' call.")
+
+        if routine.layout is None:
+            routines.cell(routine)[0]()
+            return
+
+        frames.append([routine.layout] + [argument() for argument in arguments])
+        routines.cell(routine)[0]()
+        frames.pop()
+    return run
+
+
+def compile_memoized_call(routine, arguments, cell, env):
+    """
+    Compiles a call going through the memoizer, which only runs the routine if it cannot replay it
+    """
+    memoizer = env.memoizer
+    frames = env.frames
+    layout = routine.layout
+
+    def call(values):
+        if layout is None:
+            cell[0]()
+            return
+        frames.append([layout] + values)
+        cell[0]()
+        frames.pop()
+
+    return lambda: memoizer.call(routine, [argument() for argument in arguments], call)
+
+
+@addToClass(AST.TokenNode)
+def compile(self, env, routines):
+    value = self.value
+    name = self.tok
+    lineno = self.lineno
+    frames = env.frames
+
+    # Literals and constants
+    if value is not UNSET:
+        return lambda: value
+
+    # Variables not declared by any enclosing frame belong to a caller
+    if self.slot is None:
+        return lambda: lookup(frames, name, lineno)
+
+    index = -1 - self.depth
+    slot = self.slot
+
+    def run():
+        value = frames[index][slot]
+        if value is UNSET:
+            return lookup(frames, name, lineno)
+        return value
+    return run
+
+
+@addToClass(AST.OpNode)
+def compile(self, env, routines):
+    operator = env.operators[self.op]
+    lineno = self.lineno
+
+    # Unary operators behave like a binary operation with 0 as left operand
+    if len(self.children) == 1:
+        operand = self.children[0].compile(env, routines)
+        return lambda: operator(0, operand())
+
+    left = self.children[0].compile(env, routines)
+    right = self.children[1].compile(env, routines)
+
+    if self.op == '/':
+        def run():
+            x = left()
+            y = right()
+            # Prevent dividing by 0
+            if y == 0:
+                raise DesSineError("Semantic error", lineno, "Division by zero.")
+            return operator(x, y)
+        return run
+
+    return lambda: operator(left(), right())
+
+
+@addToClass(AST.ComparisonNode)
+def compile(self, env, routines):
+    comparator = env.comparators[self.operator]
+    left = self.children[0].compile(env, routines)
+    right = self.children[1].compile(env, routines)
+    return lambda: comparator(left(), right())
+
+
+@addToClass(AST.AssignNode)
+def compile(self, env, routines):
+    identifier = self.children[0].tok
+    slot = self.children[0].slot
+    expression = self.children[1].compile(env, routines)
+    frames = env.frames
+
+    def run():
+        value = expression()
+
+        # Same rule as the interpreter: the innermost frame if the variable is set there,
+        # otherwise its own frame if it exists, or a declaration in the innermost frame
+        frame = frames[-1]
+        if frame[slot] is not UNSET:
+            frame[slot] = value
+        else:
+            assign(frames, identifier, slot, value)
+    return run
+
+
+@addToClass(AST.WhileNode)
+def compile(self, env, routines):
+    condition = self.children[0].compile(env, routines)
+    block = self.children[1].compile(env, routines)
+
+    if env.limits is not None:
+        limits = env.limits
+        lineno = self.lineno
+        statements = weight(self.children[1])
+
+        def run():
+            while condition():
+                limits.step(lineno, statements)
+                block()
+        return run
+
+    def run():
+        while condition():
+            block()
+    return run
+
+
+@addToClass(AST.IfNode)
+def compile(self, env, routines):
+    condition = self.children[0].compile(env, routines)
+    then_block = self.children[1].compile(env, routines)
+
+    if len(self.children) > 2:
+        else_block = self.children[2].compile(env, routines)
+
+        def run():
+            if condition():
+                then_block()
+            else:
+                else_block()
+        return run
+
+    def run():
+        if condition():
+            then_block()
+    return run
+
+
+@addToClass(AST.ForNode)
+def compile(self, env, routines):
+    init, condition, increment, block = (c.compile(env, routines) for c in self.children)
+
+    if env.limits is not None:
+        limits = env.limits
+        lineno = self.lineno
+        statements = weight(self.children[3]) + 1
+
+        def run():
+            init()
+            while condition():
+                limits.step(lineno, statements)
+                block()
+                increment()
+        return run
+
+    def run():
+        init()
+        while condition():
+            block()
+            increment()
+    return run
+
+
+def compile_built_in(node, env, routines):
+    """
+    Compiles a call to a built-in, for both the FunctionNode and InitNode.
+    The number of arguments has been checked by the resolver.
+    """
+    method = node.method
+    arguments = tuple(c.compile(env, routines) for c in node.children)
+
+    if not arguments:
+        return lambda: method([])
+
+    if len(arguments) == 1:
+        argument = arguments[0]
+        return lambda: method([argument()])
+
+    return lambda: method([argument() for argument in arguments])
+
+
+@addToClass(AST.FunctionNode)
+def compile(self, env, routines):
+    return compile_built_in(self, env, routines)
+
+
+@addToClass(AST.InitNode)
+def compile(self, env, routines):
+    return compile_built_in(self, env, routines)
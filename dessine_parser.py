@@ -1,8 +1,8 @@
 import ply.yacc as yacc
 import AST
-from lex import tokens
-import logger
-import sys
+from lex import tokens, lexer
+from errors import DesSineError
+import sys, threading
 
 ###########################################
 # DesSine parser
@@ -17,14 +17,15 @@ def p_program(p):
 
 
 # Init block must contain at least one instruction
+# Instructions are appended to the block in place, so that parsing stays linear in their number
 def p_init_block(p):
     '''init_block : init 
         | init_block newline init'''
-    try:
-        children = p[1].children + [p[3]]
-    except:
-        children = [p[1]]
-    p[0] = AST.InitBlockNode(p.lineno(1), children)
+    if len(p) == 2:
+        p[0] = AST.InitBlockNode(p.lineno(1), [p[1]])
+    else:
+        p[1].children.append(p[3])
+        p[0] = p[1]
 
 
 # An init instruction consists of an init function call (e.g. #width(100))
@@ -43,13 +44,15 @@ def p_routine_call(p):
     p[0] = AST.RoutineCallNode(p.lineno(1), p[1], p[3])
 
 
+# Same as the init block, statements are appended to the body in place
 def p_body(p):
     '''body : statement
         | body newline statement'''
-    try:
-        p[0] = AST.BodyNode(p.lineno(1), p[1].children + [p[3]])
-    except:
-        p[0] = AST.BodyNode(p.lineno(1), p[1])
+    if len(p) == 2:
+        p[0] = AST.BodyNode(p.lineno(1), [p[1]])
+    else:
+        p[1].children.append(p[3])
+        p[0] = p[1]
 
 # The next two rules are used to "absorb" new lines surrounding the body
 def p_reduce_left_body(p):
@@ -76,20 +79,28 @@ def p_empty(p):
     'empty :'
     pass
 
-# Parameters can be empty, contain one expression, or a list of expression separated by commas
+# Parameters can be empty, contain one expression, or a list of expressions separated by commas
+# (a trailing comma is allowed)
 def p_parameters(p):
-    '''parameters : expression
-        | expression COMMA parameters'''
-    try:
-        p[0] = [p[1]] + p[3]
-    except:
-        p[0] = [p[1]]
+    '''parameters : expressions
+        | expressions COMMA'''
+    p[0] = p[1]
 
 # For lisibility's sake
 def p_empty_parameters(p):
     'parameters : empty'
     p[0] = []
 
+# Left recursive, so that expressions are appended in place and the parser's stack stays small
+def p_expressions(p):
+    '''expressions : expression
+        | expressions COMMA expression'''
+    if len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[1].append(p[3])
+        p[0] = p[1]
+
 
 def p_statement(p):
     '''statement : assignment
@@ -177,7 +188,8 @@ def p_expression_op(p):
     '''expression : expression ADD_OP expression
     | expression MUL_OP expression
     | expression MOD_OP expression'''
-    p[0] = AST.OpNode(p.lineno(1), p[2], [p[1], p[3]])
+    # The line of the operator, as expressions do not carry one
+    p[0] = AST.OpNode(p.lineno(2), p[2], [p[1], p[3]])
 
 
 def p_unary_op(p):
@@ -189,22 +201,47 @@ def p_expression_paren(p):
     'expression : PARENTHESIS_OPEN expression PARENTHESIS_CLOSE'
     p[0] = p[2]
 
-# The parser exits whenever it encounters an error
+# The parser stops at the first error it encounters
 def p_error(p):
-    try:
-        logger.error("Syntax error", p.lineno, f"Unexpected token '{p.value}'")
-    except:
-        # p is None => end of file reached
-        logger.error("Syntax error", "EOF", "Couldn't parse program, check for missing bracket / parenthesis")
-    
-    sys.exit(-1)
+    if p is None:
+        # End of file reached
+        raise DesSineError("Syntax error", "EOF", "Couldn't parse program, check for missing bracket / parenthesis")
+
+    raise DesSineError("Syntax error", p.lineno, f"Unexpected token '{p.value}'")
+
+
+# The parser's tables are generated once and kept in the cache (never in the working directory),
+# they are then loaded without checking them against the grammar, see cache.py
+def build_parser():
+    import cache, os
+
+    path = cache.table_path("parsetab", ".pickle")
+    if path is None:
+        return yacc.yacc(debug=False, write_tables=False)
+
+    if os.path.exists(path):
+        try:
+            return yacc.yacc(debug=False, optimize=True, picklefile=path)
+        except Exception:
+            # Unreadable tables (e.g. half written by a concurrent run), generated again
+            os.remove(path)
+
+    return yacc.yacc(debug=False, optimize=True, picklefile=path)
+
 
+parser = build_parser()
 
-yacc.yacc(outputdir='')
+# The parser and the lexer keep their state while parsing, so programs are parsed one at a time
+lock = threading.Lock()
 
 
-def parse(program):
-    return yacc.parse(program)
+def parse(program, lineno=1):
+    """
+    Returns the tree of the given program, whose first line is numbered lineno
+    """
+    with lock:
+        lexer.lineno = lineno
+        return parser.parse(program, lexer=lexer)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+import logger
+
+###########################################
+# DesSine errors
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# Errors of the programs are raised rather than exiting the process, so that the interpreter can
+# be used as a library. The command line interpreter logs them and exits.
+
+
+class DesSineError(Exception):
+    """
+    Error in a DesSine program
+
+    Args:
+        kind: Kind of error, e.g. "Syntax error", prefixing the log entry
+        line: Line where the error occured
+        message: Message to display
+    """
+
+    def __init__(self, kind, line, message):
+        super().__init__(f"{kind}, line {line}: {message}")
+        self.kind = kind
+        self.line = line
+        self.message = message
+
+    def log(self):
+        logger.error(self.kind, self.line, self.message)
+
+
+class ProgramErrors(DesSineError):
+    """
+    Several errors found at once, before running the program (see resolver.py)
+    """
+
+    def __init__(self, errors):
+        super().__init__(errors[0].kind, errors[0].line, errors[0].message)
+        self.errors = errors
+
+    def log(self):
+        for error in self.errors:
+            error.log()
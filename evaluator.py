@@ -0,0 +1,254 @@
+import AST
+from AST import addToClass
+
+import compiler
+from errors import DesSineError
+from limits import weight
+
+###########################################
+# DesSine explicit stack evaluator
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# The stack engine runs routine calls without python recursion, so that programs may recurse
+# hundreds of thousands of levels deep. The body of the program and the block of each routine
+# are flattened into a list of instructions, where ifs and loops become jumps. A call pushes
+# where to return to on a stack held in a list, and jumps to the instructions of its routine.
+#
+# Memoized calls (see memoizer.py) push one more entry on the stack, which tells the memoizer
+# that the call has been run when it returns.
+#
+# Routine calls are statements, so expressions never recurse: they are compiled to closures by
+# the closure compiler (compiler.py), as are the statements which neither call nor define any
+# routine, loops included, which are then run as a single instruction.
+
+# Kinds of instructions, as the first item of their tuple
+RUN = 0          # (RUN, closure): runs the closure
+JUMP_IF_NOT = 1  # (JUMP_IF_NOT, condition, target): jumps to target if condition() is false
+JUMP = 2         # (JUMP, target)
+CALL = 3         # (CALL, node, cell, arguments, layout, statements): calls a routine linked by the resolver
+CALL_NAME = 4    # (CALL_NAME, node, arguments): calls a routine defined several times
+ENTER = 5        # (ENTER, frame): pushes a copy of the frame of a block
+LEAVE = 6        # (LEAVE,): pops the frame of a block
+RETURN = 7       # (RETURN, pop): returns from a routine, popping the frame of its parameters if pop
+DEFINE = 8       # (DEFINE, definition): defines a routine defined several times
+STEP = 9         # (STEP, lineno, statements): counts a loop iteration for the limits
+MEMOIZED = 10    # (MEMOIZED, node, cell, arguments, layout, statements): calls a routine through the memoizer
+
+
+class Flattener:
+    """
+    State of the flattening of a program: the environment of the compiled closures, and the
+    compiled routines (whose cells hold instructions instead of closures)
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.routines = compiler.Routines()
+
+
+def flatten_program(program, env):
+    """
+    Flattens the body of the given ProgramNode and returns a function running it.
+    The init block is not flattened, as it is run once by the interpreter before the body.
+    """
+    flattener = Flattener(env)
+    code = []
+    program.children[1].flatten(code, flattener)
+    code.append((RETURN, False))
+    return lambda: run(code, flattener)
+
+
+def flat(node):
+    """
+    Tells whether a statement has to be flattened, i.e. whether it calls or defines a routine
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (AST.RoutineCallNode, AST.RoutineDefinitionNode)):
+            return True
+        stack.extend(node.children)
+    return False
+
+
+def flatten_statement(node, code, flattener):
+    if flat(node):
+        node.flatten(code, flattener)
+    else:
+        code.append((RUN, node.compile(flattener.env, flattener.routines)))
+
+
+@addToClass(AST.BodyNode)
+def flatten(self, code, flattener):
+    for c in self.children:
+        flatten_statement(c, code, flattener)
+
+
+@addToClass(AST.BlockNode)
+def flatten(self, code, flattener):
+    # Blocks declaring no variable do not need a frame
+    if self.frame is not None:
+        code.append((ENTER, self.frame))
+    for c in self.children:
+        flatten_statement(c, code, flattener)
+    if self.frame is not None:
+        code.append((LEAVE,))
+
+
+@addToClass(AST.RoutineDefinitionNode)
+def flatten(self, code, flattener):
+    block = []
+    self.block.flatten(block, flattener)
+    block.append((RETURN, self.layout is not None))
+    flattener.routines.cell(self)[0] = block
+    code.append((DEFINE, self))
+
+
+@addToClass(AST.RoutineCallNode)
+def flatten(self, code, flattener):
+    env = flattener.env
+    arguments = tuple(c.compile(env, flattener.routines) for c in self.children)
+
+    if self.routine is None:
+        code.append((CALL_NAME, self, arguments))
+        return
+
+    cell = flattener.routines.cell(self.routine)
+    kind = CALL if env.memoizer is None else MEMOIZED
+    code.append((kind, self, cell, arguments, self.routine.layout, weight(self.routine.block)))
+
+
+@addToClass(AST.IfNode)
+def flatten(self, code, flattener):
+    condition = self.children[0].compile(flattener.env, flattener.routines)
+    jump = len(code)
+    code.append(None)
+    flatten_statement(self.children[1], code, flattener)
+
+    if len(self.children) > 2:
+        skip = len(code)
+        code.append(None)
+        code[jump] = (JUMP_IF_NOT, condition, len(code))
+        flatten_statement(self.children[2], code, flattener)
+        code[skip] = (JUMP, len(code))
+    else:
+        code[jump] = (JUMP_IF_NOT, condition, len(code))
+
+
+def flatten_loop(node, condition, block, increment, code, flattener):
+    """
+    Flattens a loop running block (and then increment, unless None) while condition is true
+    """
+    condition = condition.compile(flattener.env, flattener.routines)
+    top = len(code)
+    code.append(None)
+
+    if flattener.env.limits is not None:
+        code.append((STEP, node.lineno, weight(block) + (increment is not None)))
+
+    flatten_statement(block, code, flattener)
+    if increment is not None:
+        flatten_statement(increment, code, flattener)
+    code.append((JUMP, top))
+    code[top] = (JUMP_IF_NOT, condition, len(code))
+
+
+@addToClass(AST.WhileNode)
+def flatten(self, code, flattener):
+    flatten_loop(self, self.children[0], self.children[1], None, code, flattener)
+
+
+@addToClass(AST.ForNode)
+def flatten(self, code, flattener):
+    flatten_statement(self.children[0], code, flattener)
+    flatten_loop(self, self.children[1], self.children[3], self.children[2], code, flattener)
+
+
+def run(code, flattener):
+    """
+    Runs the given instructions until they return, along with the routines they call
+    """
+    frames = flattener.env.frames
+    defined = flattener.routines.defined
+    limits = flattener.env.limits
+    memoizer = flattener.env.memoizer
+    # Where to return to: instructions and index of the next one, for each call being run
+    stack = []
+    pc = 0
+
+    while True:
+        instruction = code[pc]
+        kind = instruction[0]
+        pc += 1
+
+        if kind == RUN:
+            instruction[1]()
+        elif kind == JUMP_IF_NOT:
+            if not instruction[1]():
+                pc = instruction[2]
+        elif kind == JUMP:
+            pc = instruction[1]
+        elif kind == CALL:
+            _, node, cell, arguments, layout, statements = instruction
+            if limits is not None:
+                limits.enter(node.lineno, statements)
+            if layout is not None:
+                frames.append([layout] + [argument() for argument in arguments])
+            stack.append((code, pc))
+            code = cell[0]
+            pc = 0
+        elif kind == RETURN:
+            if instruction[1]:
+                frames.pop()
+            if not stack:
+                return
+            if limits is not None:
+                limits.depth -= 1
+            code, pc = stack.pop()
+            if code is None:
+                memoizer.end(pc)
+                code, pc = stack.pop()
+        elif kind == ENTER:
+            frames.append(instruction[1].copy())
+        elif kind == LEAVE:
+            frames.pop()
+        elif kind == STEP:
+            limits.step(instruction[1], instruction[2])
+        elif kind == CALL_NAME:
+            _, node, arguments = instruction
+            # Routines defined several times can only be looked up when called
+            routine = defined.get(node.name)
+            if routine is None:
+                raise DesSineError("Semantic error", node.lineno, f"No function with name '{node.name}' exists.")
+
+            if len(routine.params) != len(arguments):
+                raise DesSineError("Semantic error", node.lineno, f"Bad number of arguments in '{node.name}' call.")
+
+            cell = flattener.routines.cell(routine)
+            if limits is not None:
+                limits.enter(node.lineno, weight(routine.block))
+            if routine.layout is not None:
+                frames.append([routine.layout] + [argument() for argument in arguments])
+            stack.append((code, pc))
+            code = cell[0]
+            pc = 0
+        elif kind == DEFINE:
+            defined[instruction[1].name] = instruction[1]
+        elif kind == MEMOIZED:
+            _, node, cell, arguments, layout, statements = instruction
+            values = [argument() for argument in arguments]
+            pending = memoizer.begin(node.routine, values)
+            if pending is None:
+                # The call has been replayed
+                continue
+            if limits is not None:
+                limits.enter(node.lineno, statements)
+            if layout is not None:
+                frames.append([layout] + values)
+            # Returns to an entry telling the memoizer that the call has been run
+            stack.append((code, pc))
+            stack.append((None, pending))
+            code = cell[0]
+            pc = 0
@@ -0,0 +1,144 @@
+import AST
+from array import array
+
+###########################################
+# DesSine flat trees
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# A flat tree holds a tree in a few arrays instead of one object per node: the nodes are stored in
+# preorder, each with its opcode (the index of its class in kinds), its line, its operand (the field
+# of the node which is not a child: operator, name, token...) and the offset of the end of its
+# subtree. The children of a node are the nodes following it, each subtree ending where the next
+# one starts, so that passes which only read the tree can go through it, or skip parts of it,
+# without following references. The block of a routine definition is stored as its only child.
+#
+# Flat trees are meant for parsed (and optimized) trees, the fields set by the resolver are not
+# kept. They are how trees are kept in the cache (see cache.py): they are much smaller once
+# pickled, and pickling them does not recurse into deep trees.
+
+# Classes of the nodes, by opcode
+kinds = (
+    AST.ProgramNode,
+    AST.InitBlockNode,
+    AST.InitNode,
+    AST.BodyNode,
+    AST.BlockNode,
+    AST.AssignNode,
+    AST.IfNode,
+    AST.WhileNode,
+    AST.ForNode,
+    AST.RoutineDefinitionNode,
+    AST.RoutineCallNode,
+    AST.FunctionNode,
+    AST.ComparisonNode,
+    AST.OpNode,
+    AST.TokenNode,
+)
+
+opcodes = {kind: opcode for opcode, kind in enumerate(kinds)}
+
+# Field held by the operand of each class, if any
+operand_fields = {
+    AST.InitNode: "action",
+    AST.RoutineDefinitionNode: "name",
+    AST.RoutineCallNode: "name",
+    AST.FunctionNode: "action",
+    AST.ComparisonNode: "operator",
+    AST.OpNode: "op",
+    AST.TokenNode: "tok",
+}
+
+
+class FlatTree:
+    """
+    A tree stored in arrays, see encode and decode
+    """
+
+    def __init__(self):
+        self.opcodes = array("B")
+        self.lines = array("q")
+        # Operands are python values (numbers, names), None for the nodes without one
+        self.operands = []
+        # Index following the subtree of each node
+        self.ends = array("L")
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def kind(self, index):
+        return kinds[self.opcodes[index]]
+
+    def children(self, index):
+        """
+        Yields the indexes of the children of a node
+        """
+        child = index + 1
+        while child < self.ends[index]:
+            yield child
+            child = self.ends[child]
+
+    def find(self, *classes):
+        """
+        Yields the indexes of the nodes of the given classes, in preorder
+        """
+        wanted = {opcodes[cls] for cls in classes}
+        return (index for index, opcode in enumerate(self.opcodes) if opcode in wanted)
+
+
+def encode(tree):
+    """
+    Returns the FlatTree of the given tree
+    """
+    flat = FlatTree()
+    # Nodes to add, and negative markers ~index of the nodes whose subtree is complete
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, int):
+            flat.ends[~node] = len(flat.opcodes)
+            continue
+
+        cls = type(node)
+        field = operand_fields.get(cls)
+        operand = getattr(node, field) if field is not None else None
+        if cls is AST.RoutineDefinitionNode:
+            operand = (operand, tuple(node.params))
+            children = [node.block]
+        else:
+            children = node.children
+
+        stack.append(~len(flat.opcodes))
+        flat.opcodes.append(opcodes[cls])
+        flat.lines.append(node.lineno)
+        flat.operands.append(operand)
+        flat.ends.append(0)
+        stack.extend(reversed(children))
+    return flat
+
+
+def decode(flat):
+    """
+    Returns the tree stored in the given FlatTree
+    """
+    # The nodes are made from the last one, their children are the last nodes made
+    made = []
+    for index in range(len(flat.opcodes) - 1, -1, -1):
+        cls = kinds[flat.opcodes[index]]
+        lineno = flat.lines[index]
+        operand = flat.operands[index]
+        children = [made.pop() for _ in range(sum(1 for _ in flat.children(index)))]
+
+        if cls is AST.RoutineDefinitionNode:
+            name, params = operand
+            node = AST.RoutineDefinitionNode(lineno, name, [], children[0])
+            node.params = list(params)
+        elif cls is AST.TokenNode:
+            node = AST.TokenNode(lineno, operand)
+        elif cls in operand_fields:
+            node = cls(lineno, operand, children)
+        else:
+            node = cls(lineno, children)
+        made.append(node)
+    return made.pop()
@@ -3,10 +3,14 @@ from AST import addToClass
 from functools import reduce
 from collections import namedtuple
 
-from math import pi, sin, cos
+from math import pi, sin, cos, hypot, ceil, isfinite
 
-import tkinter as tk
 import sys, logger
+import resolver
+from errors import DesSineError
+from limits import Limits, LimitExceeded, allow_depth, limit_status, stack_exhausted, weight
+from resolver import UNSET, lookup, assign
+from segments import SegmentBuffer
 
 ###########################################
 # DesSine interpreter
@@ -14,7 +18,12 @@ import sys, logger
 # Last updated on 11.01.20
 ###########################################
 
-jsLines = []
+# A program runs in a RenderContext, which holds everything a run changes: the state of the
+# turtle, the segments drawn, the frames of the variables, the routines defined... An Interpreter
+# only holds the options of the runs and gives each of them a new context, so that it can run
+# any number of programs, on several threads at once. Errors in the programs raise DesSineError
+# (see errors.py), the command line interpreter logs them and exits.
+
 operators = {
     '+': lambda x, y: x + y,
     '-': lambda x, y: x - y,
@@ -32,31 +41,33 @@ comparators = {
     '!=': lambda x, y: x != y,
 }
 
-scopes = [{}]
-Routine = namedtuple("Routine", ["params", "blockNode"])
-routines = {}
-
 default_width = 480
 default_height = 360
-globals = {
-    "width": 0,
-    "height": 0,
-    "background": "white",
-    "color": "black",
-    "lineWidth": 1,
-    "position": (0, 0),
-    "vector": (1, 0),
-    "canvas": None,
-    "line_count": 0,
+
+# Pure built-ins have no side effect, the optimizer may call them on constant arguments.
+# Here, method is the name of the method of RenderContext implementing the built-in.
+Function = namedtuple("Function", ["method", "arity", "pure"], defaults=[False])
+built_ins = {
+    'width': Function("method_width", 1),
+    'height': Function("method_height", 1),
+    'background': Function("method_background", 1),
+    'draw': Function("method_draw", 0),
+    'move': Function("method_move", 0),
+    'rotate': Function("method_rotate", 1),
+    'scale': Function("method_scale", 1),
+    'setColor': Function("method_set_color", 1),
+    'log': Function("method_log", -1),
+    'sin': Function("method_sin", 1, True),
+    'setLineWidth': Function("method_set_line_width", 1),
+    'vectorLength': Function("method_vector_length", 0),
 }
 
-def check_init_block():
-    """
-    Checks if the dimensions have been set during the initialization.
-    """
-    if globals["width"] * globals["height"] == 0:
-        logger.error("Semantic error", "0", "Missing dimension initialization")
-        sys.exit(-1)
+# Built-ins a memoized routine may call (see memoizer.py)
+replayable = {"draw", "move", "rotate", "scale", "sin"}
+
+constants = {
+    "PI": pi,
+}
 
 
 def to_hex_color(color):
@@ -69,253 +80,436 @@ def to_hex_color(color):
         return color
 
 
-def method_width(arr):
+class RenderContext:
     """
-    Init function that sets the width of the window
+    State of a single run of a program
     """
-    width = arr[0]
-    if width <= 0:
-        logger.error("Semantic error", "0 (init block)", f"Cannot set width to non-positive value {width}")
-        sys.exit(-1)
-
-    globals["width"] = width
-
 
-def method_height(arr):
+    def __init__(self):
+        # Every segment drawn by the program, read by the window, drawing.js and PNG outputs
+        self.segments = SegmentBuffer()
+        # Frames of the variables (see resolver.py), the program's frame is pushed before running it
+        self.frames = []
+        # Definitions of the routines defined several times, by name
+        self.routines = {}
+        self.state = {
+            "width": 0,
+            "height": 0,
+            "background": "white",
+            "color": "black",
+            "lineWidth": 1,
+            "position": (0, 0),
+            "vector": (1, 0),
+        }
+        # Duration in seconds of the phases of the run: parse, resolve (optimizing, resolving and
+        # running the init block), execute and output
+        self.phases = {}
+        # Built-ins, with their methods bound to this context
+        self.built_ins = {name: f._replace(method=getattr(self, f.method)) for name, f in built_ins.items()}
+
+        self.tree = None
+        self.engine = "tree"
+        # Optional parts of the run, see Interpreter
+        self.memoizer = None
+        self.limits = None
+        self.profiler = None
+        self.deduplicator = None
+        self.culler = None
+        # LimitExceeded which stopped the program, if any
+        self.exceeded = None
+        self.warned_length_zero = False
+
+    def check_init_block(self):
+        """
+        Checks if the dimensions have been set during the initialization.
+        """
+        if self.state["width"] * self.state["height"] == 0:
+            raise DesSineError("Semantic error", "0", "Missing dimension initialization")
+
+    def environment(self):
+        """
+        Returns the environment of the closure compiler for this run
+        """
+        import compiler
+        return compiler.Environment(self.frames, operators, comparators, self.memoizer, self.limits)
+
+    def compile(self):
+        """
+        Returns a function running the body of the program with the engine of the run
+        """
+        if self.engine == "closure":
+            import compiler
+            return compiler.compile_program(self.tree, self.environment())
+        if self.engine == "stack":
+            import evaluator
+            return evaluator.flatten_program(self.tree, self.environment())
+        return lambda: self.tree.execute(self)
+
+    def execute(self):
+        """
+        Runs the body of the program. If a limit stops it, the LimitExceeded is kept in
+        exceeded, along with the segments drawn so far.
+        """
+        from time import perf_counter
+
+        start = perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable(self, "execute" if self.engine == "tree" else "compile")
+        try:
+            # Compiling is part of the execution, so that it is measured by the profiler
+            run = self.compile()
+            if self.limits is not None:
+                self.limits.start()
+            if self.profiler is not None:
+                self.profiler.run(run)
+            else:
+                run()
+        except LimitExceeded as e:
+            self.exceeded = e
+        except RecursionError:
+            # Runaway recursion, stopped like by the depth limit: the drawing so far is kept
+            self.exceeded = stack_exhausted()
+        finally:
+            if self.culler is not None:
+                self.culler.flush()
+            if self.profiler is not None:
+                self.profiler.disable()
+            self.phases["execute"] = perf_counter() - start
+
+    def method_width(self, arr):
+        """
+        Init function that sets the width of the window
+        """
+        width = arr[0]
+        if width <= 0:
+            raise DesSineError("Semantic error", "0 (init block)", f"Cannot set width to non-positive value {width}")
+        if not isfinite(width):
+            raise DesSineError("Semantic error", "0 (init block)", f"Cannot set width to infinite value {width}")
+
+        # Canvases are made of whole pixels, rounded up, the same for every backend
+        self.state["width"] = ceil(width)
+
+    def method_height(self, arr):
+        """
+        Init function that sets the height of the window
+        """
+        height = arr[0]
+        if height <= 0:
+            raise DesSineError("Semantic error", "0 (init block)", f"Cannot set height to non-positive value {height}")
+        if not isfinite(height):
+            raise DesSineError("Semantic error", "0 (init block)", f"Cannot set height to infinite value {height}")
+
+        # Canvases are made of whole pixels, rounded up, the same for every backend
+        self.state["height"] = ceil(height)
+
+    def method_background(self, arr):
+        """
+        Init function that sets the background color of the window
+        """
+        color = arr[0]
+        if 0 <= color <= 0xFFFFFF:
+            self.state["background"] = arr[0]
+        else:
+            raise DesSineError("Semantic error", "0 (init block)",
+                               f"Could not set color to 0x{color:06x} because it is out of bounds. Exiting.")
+
+    def method_draw(self, arr):
+        """
+        Draws a line between the current position along the current vector (but does not move the current point)
+        """
+        x, y = self.state["position"]
+        dx, dy = self.state["vector"]
+        self.segments.append(x, y, x + dx, y + dy, self.state["color"], self.state["lineWidth"])
+
+        if self.memoizer is not None:
+            self.memoizer.draw(x, y, x + dx, y + dy)
+
+    def method_move(self, arr):
+        """
+        Move the current point along the current vector
+        """
+        self.state["position"] = tuple(
+            [self.state["position"][i] + self.state["vector"][i] for i in [0, 1]])
+
+    def method_rotate(self, arr):
+        """
+        Rotate the current vector
+        """
+        angle = arr[0]
+        x, y = self.state["vector"]
+
+        self.state["vector"] = (cos(angle) * x + sin(angle) * y,
+                                - sin(angle) * x + cos(angle) * y)
+
+    def method_scale(self, arr):
+        """
+        Scale the current vector
+        """
+        self.state["vector"] = tuple(map(lambda x: arr[0] * x, self.state["vector"]))
+        if not self.warned_length_zero and self.state["vector"][0] == 0 and self.state["vector"][1] == 0:
+            logger.warning("Runtime warning", f"The vector has reached length 0 after drawing {len(self.segments)} lines.")
+            self.warned_length_zero = True
+
+    def method_set_color(self, arr):
+        """
+        Set the color of the lines
+        """
+        color = arr[0]
+        if 0 <= color <= 0xFFFFFF:
+            self.state["color"] = color
+        else:
+            logger.warning("Runtime warning", f"Cannot set color to 0x{color:06x}. Color is unchanged.")
+
+    def method_log(self, arr):
+        """
+        Log the given variables
+        """
+        logger.debug(arr)
+
+    def method_sin(self, arr):
+        """
+        Sinus, accepts radians
+        """
+        return sin(arr[0])
+
+    def method_set_line_width(self, arr):
+        """
+        Set the line's width in pixels
+        """
+        self.state["lineWidth"] = arr[0]
+
+    def method_vector_length(self, arr):
+        """
+        Length of the current vector, in pixels
+        """
+        return hypot(*self.state["vector"])
+
+
+class Interpreter:
     """
-    Init function that sets the height of the window
+    Runs DesSine programs with the given options, each in a RenderContext of its own.
+    Raises DesSineError on errors in the programs.
     """
-    height = arr[0]
-    if height <= 0:
-        logger.error("Semantic error", "0 (init block)", f"Cannot set height to non-positive value {height}")
-        sys.exit(-1)
-
-    globals["height"] = height
 
-
-def method_background(arr):
-    """
-    Init function that sets the background color of the window
-    """
-    color = arr[0]
-    if 0 <= color <= 0xFFFFFF:
-        globals["background"] = arr[0]
-    else:
-        logger.error("Semantic error", "0 (init block)", f"Could not set color to 0x{color:06x} because it is out of bounds. Exiting.")
-        sys.exit(-1)
-
-
-def method_draw(arr):
-    """
-    Draws a line between the current position along the current vector (but does not move the current point)
-    """
-    x, y = globals["position"]
-    dx, dy = globals["vector"]
-    lw = globals["lineWidth"]
-    color = to_hex_color(globals["color"])
-    globals["canvas"].create_line(x, y, x+dx, y+dy, fill=color, width=lw)
-
-    # Draw circles at endpoints to avoid disjointed segments
-    if lw > 3:
-        globals["canvas"].create_oval(
-            x - lw / 2, y - lw / 2, x + lw / 2, y + lw / 2, fill=color, width=0)
-        globals["canvas"].create_oval(
-            x + dx - lw / 2, y + dy - lw / 2, x + dx + lw / 2, y + dy + lw / 2, fill=color, width=0)
-
-    globals["line_count"] += 1
-    globals["canvas"].pack()
-
-    jsLines.append(f"l({x + dx}, {y + dy})")
-    jsLines.append(f"m({x}, {y})")
-
-def method_move(arr):
-    """
-    Move the current point along the current vector
-    """
-    globals["position"] = tuple(
-        [globals["position"][i] + globals["vector"][i] for i in [0, 1]])
-
-
-def method_rotate(arr):
-    """
-    Rotate the current vector
-    """
-    angle = arr[0]
-    x, y = globals["vector"]
-
-    globals["vector"] = (cos(angle) * x + sin(angle) * y,
-                         - sin(angle) * x + cos(angle) * y)
-
-
-def method_scale(arr):
-    """
-    Scale the current vector
-    """
-    globals["vector"] = tuple(map(lambda x: arr[0] * x, globals["vector"]))
-    if not method_scale.already_warned_length_zero and globals["vector"][0] == 0 and globals["vector"][1] == 0:
-        logger.warning("Runtime warning", f"The vector has reached length 0 after drawing {globals['line_count']} lines.")
-        method_scale.already_warned_length_zero = True
-
-method_scale.already_warned_length_zero = False
-
-
-def method_set_color(arr):
-    """
-    Set the color of the lines
-    """
-    color = arr[0]
-    if 0 <= color <= 0xFFFFFF:
-        globals["color"] = color
-    else:
-        logger.warning("Runtime warning", f"Cannot set color to 0x{color:06x}. Color is unchanged.")
-
-    x, y = globals["position"]
-    dx, dy = globals["vector"]
-
-    jsLines.append(f"x.strokeStyle = \"{to_hex_color(globals['color'])}\"")
-    jsLines.append(f"x.stroke()")
-    jsLines.append(f"x.beginPath()")
-    jsLines.append(f"m({x}, {y})")
-
-def method_log(arr):
-    """
-    Log the given variables
-    """
-    logger.debug(arr)
-
-
-def method_sin(arr):
-    """
-    Sinus, accepts radians
-    """
-    return sin(arr[0])
-
-
-def method_set_line_width(arr):
-    """
-    Set the line's width in pixels
-    """
-    globals["lineWidth"] = arr[0]
-
-Function = namedtuple("Function", ["method", "arity"])
-built_ins = {
-    'width': Function(method_width, 1),
-    'height': Function(method_height, 1),
-    'background': Function(method_background, 1),
-    'draw': Function(method_draw, 0),
-    'move': Function(method_move, 0),
-    'rotate': Function(method_rotate, 1),
-    'scale': Function(method_scale, 1),
-    'setColor': Function(method_set_color, 1),
-    'log': Function(method_log, -1),
-    'sin': Function(method_sin, 1),
-    'setLineWidth': Function(method_set_line_width, 1),
-}
-
-constants = {
-    "PI": pi,
-}
+    def __init__(self, engine="tree", optimize=True, memoize=False, memoize_size=1 << 20, dedup=False,
+                 profile=False, max_statements=None, max_segments=None, max_depth=None, max_time=None,
+                 cull=False, cull_tolerance=0.25):
+        """
+        Args:
+            engine: tree (walk the AST), closure (compile it to closures first) or stack
+                (run routine calls on an explicit stack, for deep recursion)
+            optimize: fold constants and merge calls before running the programs (see optimizer.py)
+            memoize: replay the calls to routines already made (see memoizer.py), keeping at
+                most memoize_size segments
+            dedup: drop the segments drawn twice with the same style
+            profile: measure the runs (see profiler.py), not supported by the stack engine
+            max_statements, max_segments, max_depth, max_time: limits of the runs (see limits.py)
+            cull: drop the segments out of the canvas, and merge the ones shorter than
+                cull_tolerance pixels (see Culler in segments.py)
+        """
+        if profile and engine == "stack":
+            raise ValueError("The stack engine cannot be profiled, use the tree or closure engine.")
+
+        self.engine = engine
+        self.optimize = optimize
+        self.memoize = memoize
+        self.memoize_size = memoize_size
+        self.dedup = dedup
+        self.profile = profile
+        self.limits = (max_statements, max_segments, max_depth, max_time)
+        self.cull = cull
+        self.cull_tolerance = cull_tolerance
+
+    def parse(self, source, context):
+        """
+        Returns the tree of the given program
+        """
+        from cache import parse
+        from time import perf_counter
+
+        start = perf_counter()
+        tree = parse(source)
+        context.phases["parse"] = perf_counter() - start
+        return tree
+
+    def optimize_tree(self, tree, context):
+        import optimizer
+        optimizer.optimize_program(tree, operators, comparators, constants, context.built_ins)
+
+    def prepare(self, tree, context, optimized=False):
+        """
+        Optimizes (unless optimized tells it already is) and resolves the tree of a program and
+        runs its init block in the given context, which is then ready to execute the body of
+        the program
+        """
+        from time import perf_counter
+
+        start = perf_counter()
+        if self.optimize and not optimized:
+            self.optimize_tree(tree, context)
+
+        self.resolve(tree, context)
+        context.frames.append(tree.frame.copy())
+
+        tree.init(context)
+        context.check_init_block()
+        context.phases["resolve"] = perf_counter() - start
+
+        self.reset(context)
+
+        if self.profile:
+            from profiler import Profiler
+            context.profiler = Profiler()
+
+        if self.cull:
+            from segments import Culler
+            context.culler = Culler(context.segments, context.state["width"], context.state["height"],
+                                    self.cull_tolerance)
+            context.segments.filters.append(context.culler)
+
+        if self.dedup:
+            from segments import Deduplicator
+            context.deduplicator = Deduplicator()
+            context.segments.filters.append(context.deduplicator)
+
+    def resolve(self, tree, context):
+        """
+        Resolves the tree of a program, to be run in the given context
+        """
+        resolver.resolve_program(tree, context.built_ins, constants)
+        context.tree = tree
+        context.engine = self.engine
+
+    def reset(self, context):
+        """
+        Gives the context a new memoizer and new limits, for a new execution of its program
+        """
+        if self.memoize:
+            from memoizer import Memoizer
+            context.memoizer = Memoizer(context.state, context.segments, context.frames, replayable,
+                                        self.memoize_size)
+
+        if context.limits is not None and context.limits.segment in context.segments.filters:
+            context.segments.filters.remove(context.limits.segment)
+        context.limits = None
+        if any(limit is not None for limit in self.limits):
+            context.limits = Limits(*self.limits)
+            context.limits.watch(context.segments)
+            if context.limits.max_depth is not None and self.engine in ("tree", "closure"):
+                allow_depth(context.limits.max_depth)
+        context.exceeded = None
+
+    def render(self, source):
+        """
+        Runs the given program and returns its RenderContext, holding the segments drawn
+        """
+        context = RenderContext()
+        self.prepare(self.parse(source, context), context)
+        context.execute()
+        return context
 
 
 @addToClass(AST.ProgramNode)
-def init(self):
+def init(self, context):
     # Init block
-    self.children[0].execute()
+    self.children[0].execute(context)
 
 
 @addToClass(AST.ProgramNode)
-def execute(self):
+def execute(self, context):
     # Body block
-    self.children[1].execute()
+    self.children[1].execute(context)
 
 
 @addToClass(AST.InitBlockNode)
-def execute(self):
+def execute(self, context):
     for c in self.children:
-        c.execute()
-
-    # Create tkinter instance, canvas et set width/height
-    master = tk.Tk()
-
-    w = globals["width"]
-    h = globals["height"]
-
-    globals["canvas"] = tk.Canvas(master, width=w, height=h)
-
-    master.geometry(f"{w}x{h}")
-    globals["canvas"].config(bg=to_hex_color(globals["background"]))
+        c.execute(context)
 
     # Starting point is at the center of the screen
-    globals["position"] = (w / 2, h / 2)
+    context.state["position"] = (context.state["width"] / 2, context.state["height"] / 2)
 
 
 @addToClass(AST.BlockNode)
-def execute(self):
-    # Scope is a list, with push/pop it when we change scope
-    scopes.append({})
+def execute(self, context):
+    # Blocks declaring variables get a new frame, pushed and popped like the scope it is
+    if self.frame is None:
+        for c in self.children:
+            c.execute(context)
+        return
+
+    context.frames.append(self.frame.copy())
     for c in self.children:
-        c.execute()
-    scopes.pop()
+        c.execute(context)
+    context.frames.pop()
 
 
 @addToClass(AST.RoutineDefinitionNode)
-def execute(self):
+def execute(self, context):
     # Defining routines
-    routines[self.name] = Routine(self.params, self.block)
+    context.routines[self.name] = self
 
 
 @addToClass(AST.RoutineCallNode)
-def execute(self):
-    # Check routine validity before callling them
-    # Name
-    if self.name not in routines.keys():
-        logger.error("Semantic error", self.lineno, f"No function with name '{self.name}' exists.")
-        sys.exit(-1)
-    
-    routine = routines[self.name]
-    
-    # Args length
-    if len(routine.params) != len(self.children):
-        logger.error("Semantic error", self.lineno, f"Bad number of arguments in '{self.name}' call.")
-        sys.exit(-1)
+def execute(self, context):
+    routine = self.routine
 
-    # Execute parameters
-    args = [c.execute() for c in self.children]
+    # Calls are linked to their routine by the resolver, unless it is defined several times
+    if routine is None:
+        if self.name not in context.routines:
+            raise DesSineError("Semantic error", self.lineno, f"No function with name '{self.name}' exists.")
 
-    # New scope for the function
-    scopes.append({})
+        routine = context.routines[self.name]
 
-    # Set parameters values in the function scope (parameters are converted to "variables")
-    for param, value in zip(routine.params, args):
-        scopes[-1][param] = value
-    
-    routine.blockNode.execute()
+        if len(routine.params) != len(self.children):
+            raise DesSineError("Semantic error", self.lineno, f"Bad number of arguments in '{self.name}' call.")
 
-    # Exit function scope
-    scopes.pop()
+    arguments = [c.execute(context) for c in self.children]
+
+    limits = context.limits
+    if limits is not None:
+        limits.enter(self.lineno, weight(routine.block))
+
+    # Routines defined once can be replayed instead of run, when memoization is enabled
+    if context.memoizer is not None and self.routine is not None:
+        context.memoizer.call(routine, arguments, lambda arguments: call_routine(context, routine, arguments))
+    else:
+        call_routine(context, routine, arguments)
+
+    if limits is not None:
+        limits.depth -= 1
+
+
+def call_routine(context, routine, arguments):
+    """
+    Runs the block of the routine, in a new frame holding the parameters' values
+    """
+    if routine.layout is None:
+        routine.block.execute(context)
+        return
+
+    context.frames.append([routine.layout] + arguments)
+    routine.block.execute(context)
+    context.frames.pop()
 
 
 @addToClass(AST.TokenNode)
-def execute(self):
-    if isinstance(self.tok, str):
-        # Is the token a constant?
-        if self.tok in constants:
-            return constants[self.tok]
-
-        # We can access variables from parent scopes so we have to check each scope to find
-        # if a variable is defined or not
-        for scope in scopes[-1::-1]:
-            if self.tok in scope.keys():
-                return scope[self.tok]
-        logger.error("Semantic error", self.lineno, f"Variable '{self.tok}' is not defined.")
-        sys.exit(-1)
+def execute(self, context):
+    if self.slot is not None:
+        value = context.frames[-1 - self.depth][self.slot]
+        if value is not UNSET:
+            return value
+    elif self.value is not UNSET:
+        # Literals and constants
+        return self.value
 
-    return self.tok
+    # The variable is not set in its frame, it may be in the one of a caller
+    return lookup(context.frames, self.tok, self.lineno)
 
 
 @addToClass(AST.OpNode)
-def execute(self):
-    args = [c.execute() for c in self.children]
+def execute(self, context):
+    args = [c.execute(context) for c in self.children]
 
     # Handle unary operator
     if len(args) == 1:
@@ -323,112 +517,434 @@ def execute(self):
 
     # Prevent dividing by 0
     if self.op == '/' and args[1] == 0:
-        logger.error("Semantic error", self.lineno, "Division by zero.")
-        sys.exit(-1)
+        raise DesSineError("Semantic error", self.lineno, "Division by zero.")
 
     return reduce(operators[self.op], args)
 
 
 @addToClass(AST.ComparisonNode)
-def execute(self):
-    args = [c.execute() for c in self.children]
+def execute(self, context):
+    args = [c.execute(context) for c in self.children]
     return comparators[self.operator](args[0], args[1])
 
 
 @addToClass(AST.AssignNode)
-def execute(self):
-    identifier = self.children[0].tok
-    value = self.children[1].execute()
+def execute(self, context):
+    target = self.children[0]
+    value = self.children[1].execute(context)
+
+    # Variables are assigned in the innermost frame if they are already set there, otherwise
+    # an existing variable is updated in its own frame or it is declared in the innermost one
+    frame = context.frames[-1]
+    if frame[target.slot] is not UNSET:
+        frame[target.slot] = value
+    else:
+        assign(context.frames, target.tok, target.slot, value)
 
-    # When assigning a variable, we need to check if it does not exists in a parent scope
-    # If it does, we change it in the parent scope
-    for scope in scopes[-1::-1]:
-        if identifier in scope.keys():
-            scope[identifier] = value
-            return
 
-    # If it does not exists, we declare it in the current scope
-    scopes[-1][identifier] = value
+@addToClass(AST.WhileNode)
+def execute(self, context):
+    condition, block = self.children
 
+    # Each iteration is counted when the run has limits
+    limits = context.limits
+    if limits is not None:
+        statements = weight(block)
+        while condition.execute(context):
+            limits.step(self.lineno, statements)
+            block.execute(context)
+        return
 
-@addToClass(AST.WhileNode)
-def execute(self):
-    while self.children[0].execute():
-        self.children[1].execute()
+    while condition.execute(context):
+        block.execute(context)
 
 
 @addToClass(AST.BodyNode)
-def execute(self):
+def execute(self, context):
     for c in self.children:
-        c.execute()
+        c.execute(context)
 
 
 @addToClass(AST.InitNode)
-def execute(self):
-    args = [c.execute() for c in self.children]
-    func = built_ins[self.action]
-
-    # Check valid number of args
-    if len(args) == func.arity or func.arity == -1:
-        return func.method(args)
-
-    logger.error("Semantic error", self.lineno, f"Bad number of arguments in {self.action} call.")
-    sys.exit(-1)
+def execute(self, context):
+    # The method and the number of arguments are checked by the resolver
+    return self.method([c.execute(context) for c in self.children])
 
 
 @addToClass(AST.IfNode)
-def execute(self):
+def execute(self, context):
     # if "or" if ... else
-    if self.children[0].execute():
-        self.children[1].execute()
+    if self.children[0].execute(context):
+        self.children[1].execute(context)
     elif len(self.children) > 2:
-        self.children[2].execute()
+        self.children[2].execute(context)
 
 
 @addToClass(AST.ForNode)
-def execute(self):
+def execute(self, context):
+    init, condition, increment, block = self.children
+    limits = context.limits
+    statements = weight(block) + 1
+
     # Init
-    self.children[0].execute()
+    init.execute(context)
     # Condition
-    while self.children[1].execute():
+    while condition.execute(context):
+        if limits is not None:
+            limits.step(self.lineno, statements)
         # Body
-        self.children[3].execute()
+        block.execute(context)
         # Increment
-        self.children[2].execute()
+        increment.execute(context)
 
 
 @addToClass(AST.FunctionNode)
-def execute(self):
-    args = [c.execute() for c in self.children]
-    func = built_ins[self.action]
+def execute(self, context):
+    # The method and the number of arguments are checked by the resolver
+    return self.method([c.execute(context) for c in self.children])
+
 
-    # Check valid number of args
-    if len(args) == func.arity or func.arity == -1:
-        return func.method(args)
-    logger.error("Semantic error", self.lineno, f"Bad number of arguments in '{self.action}' call.")
-    sys.exit(-1)
+def render_png(context, path, antialias=True, tile_size=None, jobs=None):
+    """
+    Rasterizes the segments drawn by the program and writes them to a PNG file.
+    If a tile size is given, tiles of that size are rasterized in parallel by jobs processes.
+    """
+    import rasterizer
+
+    segments = context.segments
+    width, height = context.state["width"], context.state["height"]
+    background = rasterizer.to_rgb(to_hex_color(context.state["background"]))
+    colors = [rasterizer.to_rgb(to_hex_color(c)) for c in segments.colors]
+    if tile_size:
+        image = rasterizer.rasterize_tiles(segments, width, height, background, colors, antialias, tile_size, jobs)
+    else:
+        image = rasterizer.rasterize(segments, width, height, background, colors, antialias)
 
+    rasterizer.write_png(path, image)
+    logger.info("DesSine", f"Wrote {len(segments)} lines to {path}")
+
+
+def stream_drawing(context, path, writer_class, run):
+    """
+    Runs the program while a writer (SvgWriter, BinaryJsWriter) writes the segments to a file
+    as they are drawn. The segments are not retained, so memory does not grow with the size
+    of the drawing.
+    """
+    from segments import chunk_size
+
+    segments = context.segments
+    state = context.state
+    with open(path, 'w') as f:
+        writer = writer_class(f, state["width"], state["height"], state["background"], to_hex_color)
+        segments.retain = False
+        segments.listen(lambda start, stop: writer.write(segments.range(start, stop)), chunk_size)
+
+        run()
+
+        segments.flush()
+        writer.close()
+    logger.info("DesSine", f"Wrote {len(segments)} lines to {path}")
+
+
+def write_js(context, path):
+    """
+    Writes the segments drawn by the program as a javascript function to be loaded by index.html
+    """
+    with open(path, 'w') as f:
+        f.write("function renderLines(x, canvas) {\n")
+        style = None
+        for x0, y0, x1, y1, color, lw in context.segments:
+            # Each change of style starts a new path
+            if style != (color, lw):
+                if style is not None:
+                    f.write("x.stroke()\n")
+                style = (color, lw)
+                f.write("x.beginPath()\n")
+                f.write(f"x.strokeStyle = \"{to_hex_color(color)}\"\n")
+                f.write(f"x.lineWidth = {lw}\n")
+            f.write(f"m({x0}, {y0})\n")
+            f.write(f"l({x1}, {y1})\n")
+        f.write("\n}")
+    logger.info("DesSine", f"Wrote {len(context.segments)} lines to {path}")
+
+
+def open_window(context, canvas=None):
+    """
+    Creates the window and its canvas (or resizes the given one) to the size and background set
+    by the init block
+    """
+    w = context.state["width"]
+    h = context.state["height"]
+
+    if canvas is None:
+        import tkinter as tk
+        master = tk.Tk()
+        canvas = tk.Canvas(master, width=w, height=h)
+        canvas.pack()
+    else:
+        canvas.config(width=w, height=h)
+
+    canvas.master.geometry(f"{w}x{h}")
+    canvas.config(bg=to_hex_color(context.state["background"]))
+    return canvas
+
+
+def draw_on_canvas(canvas, segments, start, stop, tags=()):
+    """
+    Creates the canvas items of the segments from index start to stop (excluded), with the given tags
+    """
+    for x0, y0, x1, y1, color, lw in segments.range(start, stop):
+        color = to_hex_color(color)
+        canvas.create_line(x0, y0, x1, y1, fill=color, width=lw, tags=tags)
+
+        # Draw circles at endpoints to avoid disjointed segments
+        if lw > 3:
+            canvas.create_oval(
+                x0 - lw / 2, y0 - lw / 2, x0 + lw / 2, y0 + lw / 2, fill=color, width=0, tags=tags)
+            canvas.create_oval(
+                x1 - lw / 2, y1 - lw / 2, x1 + lw / 2, y1 + lw / 2, fill=color, width=0, tags=tags)
+
+
+def render_progressively(context, run, batch_size=1000, draw_chunk=5000, queue_size=64):
+    """
+    Runs the body of the program on a worker thread, while the window draws the segments as they
+    are produced. The worker hands batches of batch_size segments to the window through a bounded
+    queue (it waits when the window lags behind), and the window creates at most draw_chunk
+    canvas items each time it drains the queue, so it stays responsive.
+    """
+    import threading, queue
+
+    segments = context.segments
+    canvas = open_window(context)
+    batches = queue.Queue(maxsize=queue_size)
+    outcome = {}
+
+    def worker():
+        try:
+            run()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            segments.flush()
+            batches.put(None)
+
+    # Range of segments received but not drawn yet
+    pending = [0, 0]
+
+    def drain():
+        budget = draw_chunk
+        while budget > 0:
+            if pending[0] == pending[1]:
+                try:
+                    batch = batches.get_nowait()
+                except queue.Empty:
+                    break
+                if batch is None:
+                    if "error" in outcome:
+                        canvas.master.destroy()
+                    else:
+                        logger.info("DesSine", f"Rendered {len(segments)} lines.")
+                    return
+                pending[:] = batch
+
+            stop = min(pending[1], pending[0] + budget)
+            draw_on_canvas(canvas, segments, pending[0], stop)
+            budget -= stop - pending[0]
+            pending[0] = stop
+
+        # Come back right away if there is more to draw, leave time to the events otherwise
+        canvas.after(1 if budget == 0 else 20, drain)
+
+    segments.listen(lambda start, stop: batches.put((start, stop)), batch_size)
+    # The worker is a daemon so that closing the window does not wait for the program to finish
+    threading.Thread(target=worker, daemon=True).start()
+
+    canvas.after(0, drain)
+    canvas.master.mainloop()
+
+    # The error is raised once the window is closed, the process has to fail like it would without window
+    if "error" in outcome:
+        raise outcome["error"]
+
+
+def parse_arguments(argv):
+    """
+    Parses the command line arguments of the interpreter
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="DesSine interpreter")
+    parser.add_argument("file", help="DesSine program to run")
+    parser.add_argument("js", nargs="?", help="if given, write the drawing to drawing.js instead of opening a window")
+    parser.add_argument("--png", metavar="FILE", help="render the drawing to a PNG file, without opening a window")
+    parser.add_argument("--js-format", choices=["text", "binary"], default="text",
+                        help="write drawing.js as one call per segment (text) or as compact typed arrays (binary)")
+    parser.add_argument("--svg", metavar="FILE", help="stream the drawing to an SVG file, without opening a window")
+    parser.add_argument("--no-antialias", dest="antialias", action="store_false",
+                        help="disable anti-aliasing of the PNG rendering")
+    parser.add_argument("--tiles", type=int, metavar="SIZE",
+                        help="rasterize the PNG in parallel, by square tiles of SIZE pixels")
+    parser.add_argument("--jobs", type=int,
+                        help="number of processes rasterizing the tiles (one per core by default)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="drop the segments drawn twice with the same style before they reach the output")
+    parser.add_argument("--cull", action="store_true",
+                        help="drop the segments out of the canvas, clip the ones crossing its border and merge the tiny ones")
+    parser.add_argument("--cull-tolerance", type=float, default=0.25, metavar="PIXELS",
+                        help="length under which --cull merges the segments of a path")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="number of segments handed at once from the program to the window")
+    parser.add_argument("--draw-chunk", type=int, default=5000,
+                        help="maximum number of segments the window draws before handling its events")
+    parser.add_argument("--no-optimize", dest="optimize", action="store_false",
+                        help="run the program as parsed, without folding constants nor merging calls")
+    parser.add_argument("--dump-ast", action="store_true",
+                        help="print the (optimized) syntax tree and exit without running the program")
+    parser.add_argument("--memoize", action="store_true",
+                        help="replay the calls to routines already made with the same arguments")
+    parser.add_argument("--memoize-size", type=int, default=1 << 20,
+                        help="maximum number of segments kept for replaying routine calls")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the time spent on each line and by each kind of node, and the segments by routine")
+    parser.add_argument("--profile-json", metavar="FILE", help="write the measures of the profiler to a JSON file")
+    parser.add_argument("--max-statements", type=int, metavar="N",
+                        help="stop the program after N statements executed in loops and routines")
+    parser.add_argument("--max-segments", type=int, metavar="N", help="stop the program after N segments drawn")
+    parser.add_argument("--max-depth", type=int, metavar="N", help="stop the program at N nested routine calls")
+    parser.add_argument("--max-time", type=float, metavar="SECONDS",
+                        help="stop the program after running for SECONDS (the drawing so far is still output)")
+    parser.add_argument("--stream", action="store_true",
+                        help="read, parse and run the program a few statements at a time, for huge generated programs")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep the window open and run the program again from its first change each time the file is saved")
+    parser.add_argument("--engine", choices=["tree", "closure", "stack"], default="tree",
+                        help="execution engine: walk the AST (tree), compile it to closures first (closure), "
+                             "or run routine calls on an explicit stack, for deep recursion (stack)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None, context=None):
+    """
+    Runs the program given on the command line, logging its errors and exiting if there is one.
+    The program runs in the given RenderContext if any, so that the caller can read it afterwards.
+    """
+    args = parse_arguments(argv)
+    prog = None
+    if not args.stream:
+        with open(args.file) as f:
+            prog = f.read()
+
+    try:
+        run_program(prog, args, context)
+    except DesSineError as e:
+        e.log()
+        sys.exit(-1)
+
+
+def run_program(prog, args, context=None, tree=None):
+    """
+    Runs the given program as told by the command line arguments (see parse_arguments), and
+    outputs its drawing. tree is the program already parsed, if it is. In stream mode, the
+    program is read from its file as it runs, prog is not needed.
+    """
+    from time import perf_counter
+
+    if (args.profile or args.profile_json) and args.engine == "stack":
+        logger.error("Profiler error", "-", "The stack engine cannot be profiled, use the tree or closure engine.")
+        sys.exit(-1)
+
+    interpreter = Interpreter(args.engine, args.optimize, args.memoize, args.memoize_size, args.dedup,
+                              bool(args.profile or args.profile_json),
+                              args.max_statements, args.max_segments, args.max_depth, args.max_time,
+                              args.cull, args.cull_tolerance)
+    if args.stream and (args.watch or args.dump_ast or interpreter.profile or args.memoize):
+        logger.error("Stream error", "-", "The stream mode cannot be combined with --watch, --dump-ast, --profile or --memoize.")
+        sys.exit(-1)
+
+    if args.watch:
+        if args.png or args.svg or args.js or args.dump_ast or interpreter.profile:
+            logger.error("Watch error", "-", "The watch mode only runs the program in a window, without profiler.")
+            sys.exit(-1)
+
+        from watch import Watcher
+        Watcher(args.file, interpreter, RenderContext, open_window, draw_on_canvas, args.batch_size,
+                args.draw_chunk).start()
+        return None
+
+    if context is None:
+        context = RenderContext()
+
+    if args.stream:
+        from stream import Stream
+        program = Stream(args.file, interpreter, constants)
+        program.prepare(context)
+        execute = lambda: program.execute(context)
+    else:
+        if tree is None:
+            tree = interpreter.parse(prog, context)
+
+        if args.dump_ast:
+            if args.optimize:
+                interpreter.optimize_tree(tree, context)
+            print(tree, end="")
+            return context
+
+        interpreter.prepare(tree, context)
+        execute = context.execute
+    segments = context.segments
+
+    if context.limits is not None:
+        # Terminating the process stops the program cleanly, its partial drawing is still output
+        import signal, threading
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: context.limits.cancel())
+
+    def run():
+        execute()
+
+        if context.exceeded is not None:
+            e = context.exceeded
+            logger.error(e.kind, e.line, f"{e.message}, the drawing stops after {len(segments)} lines.")
+        if args.profile:
+            context.profiler.report(prog)
+        if args.profile_json:
+            context.profiler.write_json(args.profile_json)
+        if args.memoize:
+            memoizer = context.memoizer
+            logger.info("DesSine", f"Replayed {memoizer.hits} routine calls, recorded {memoizer.misses}.")
+        if args.cull:
+            culler = context.culler
+            logger.info("DesSine", f"Culled {culler.culled} segments out of the canvas, clipped {culler.clipped}, "
+                                   f"merged {culler.merged} sub-pixel segments.")
+        if args.dedup:
+            logger.info("DesSine", f"Removed {context.deduplicator.removed} duplicate segments.")
 
-if __name__ == "__main__":
-    from dessine_parser import parse
-    prog = open(sys.argv[1]).read()
-    ast = parse(prog)
-
-    ast.init()
-    check_init_block()
-    ast.execute()
-    
     # Display the result
 
-    if len(sys.argv) > 2:
-        with open('drawing.js', 'w') as f:
-            f.write("function renderLines(x, canvas) {\n")
-            for item in jsLines:
-                f.write("%s\n" % item)
-            f.write("\n}")
-        logger.info("DesSine", f"Wrote {globals['line_count']} lines to drawing.js")
+    started = perf_counter()
+    if args.png:
+        run()
+        render_png(context, args.png, args.antialias, args.tiles, args.jobs)
+    elif args.svg:
+        from svg import SvgWriter
+        stream_drawing(context, args.svg, SvgWriter, run)
+    elif args.js and args.js_format == "binary":
+        from jsexport import BinaryJsWriter
+        stream_drawing(context, 'drawing.js', BinaryJsWriter, run)
+    elif args.js:
+        run()
+        write_js(context, 'drawing.js')
     else:
-        logger.info("DesSine", f"Starting render of {globals['line_count']} lines.")
-        tk.mainloop()
+        logger.info("DesSine", "Starting render.")
+        render_progressively(context, run, args.batch_size, args.draw_chunk)
+
+    # Streamed outputs are written while the program runs, their time is in the execution's
+    context.phases["output"] = perf_counter() - started - context.phases.get("execute", 0)
 
+    if context.exceeded is not None:
+        sys.exit(limit_status)
+    return context
 
+
+if __name__ == "__main__":
+    main()
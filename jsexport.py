@@ -0,0 +1,119 @@
+from array import array
+from math import isfinite
+import base64, json, sys
+
+###########################################
+# DesSine compact drawing.js exporter
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# Coordinates are rounded to 1 / quantization pixel
+quantization = 8
+
+int16_range = range(-0x8000, 0x8000)
+
+
+def to_base64(values):
+    """
+    Encodes an array as base64, in the little endian order used by javascript typed arrays
+    """
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+class BinaryJsWriter:
+    """
+    Writes segments to drawing.js as base64 encoded typed arrays, one block per call to write.
+
+    Coordinates are quantized, then delta encoded: a segment starting where the previous one
+    ended only stores its end, relative to its start, and a flag bit tells which segments do.
+    Deltas are stored in an Int16Array when they all fit, in a Float32Array otherwise.
+    Each block lists its runs of segments sharing the same style, as pairs of
+    (index in drawing.styles, number of segments). Segments whose coordinates are not finite
+    (e.g. after a scale overflowing) are dropped, as by the other backends.
+    """
+
+    def __init__(self, file, width, height, background, format_color):
+        self.file = file
+        self.format_color = format_color
+        self.styles = {}
+        # Last quantized point, shared with the decoder across blocks
+        self.x = 0
+        self.y = 0
+
+        header = {
+            "width": width,
+            "height": height,
+            "background": format_color(background),
+            "scale": quantization,
+            "styles": [],
+            "blocks": [],
+        }
+        file.write(f"var drawing = {json.dumps(header)};\n")
+
+    def write(self, segments):
+        """
+        Writes the given (x0, y0, x1, y1, color, width) segments as a new block
+        """
+        deltas = []
+        flags = array("B")
+        runs = []
+        x, y = self.x, self.y
+        # Number of segments written
+        i = 0
+
+        for x0, y0, x1, y1, color, lw in segments:
+            points = (x0 * quantization, y0 * quantization, x1 * quantization, y1 * quantization)
+            if not all(map(isfinite, points)):
+                continue
+            qx0, qy0, qx1, qy1 = map(round, points)
+
+            style = self.style(color, lw)
+            if runs and runs[-2] == style:
+                runs[-1] += 1
+            else:
+                runs += [style, 1]
+
+            if i % 8 == 0:
+                flags.append(0)
+
+            if qx0 == x and qy0 == y:
+                flags[-1] |= 1 << (i % 8)
+            else:
+                deltas += [qx0 - x, qy0 - y]
+
+            x, y = qx1, qy1
+            deltas += [x - qx0, y - qy0]
+            i += 1
+
+        if not runs:
+            return
+
+        self.x, self.y = x, y
+
+        if all(d in int16_range for d in deltas):
+            kind, data = "i16", array("h", deltas)
+        else:
+            kind, data = "f32", array("f", deltas)
+
+        block = {"type": kind, "runs": runs, "flags": to_base64(flags), "data": to_base64(data)}
+        self.file.write(f"drawing.blocks.push({json.dumps(block)});\n")
+
+    def style(self, color, lw):
+        """
+        Returns the index of the given style in drawing.styles, declaring it if needed
+        """
+        key = (color, lw)
+        if key not in self.styles:
+            self.styles[key] = len(self.styles)
+            self.file.write(f"drawing.styles.push({json.dumps([self.format_color(color), lw])});\n")
+        return self.styles[key]
+
+    def close(self):
+        """
+        Nothing to end, every block is a complete javascript statement
+        """
+        pass
@@ -1,6 +1,6 @@
 import ply.lex as lex
 import sys
-import logger
+from errors import DesSineError
 
 ###########################################
 # DesSine lexer
@@ -75,7 +75,7 @@ builtin_actions = ("draw",
                    "log",)
 
 # builting methods returning something
-builtin_functions = ("sin",)
+builtin_functions = ("sin", "vectorLength")
 
 # constants (called readonlys because it may support position in the future)
 builtin_readonlys = ("PI",)
@@ -130,12 +130,29 @@ t_ignore = " \t"
 
 
 def t_error(t):
-    logger.error("Lexical error", t.lineno, f"illegal character '{t.value[0]}'")
-    t.lexer.skip(1)
-    sys.exit()
+    raise DesSineError("Lexical error", t.lineno, f"illegal character '{t.value[0]}'")
 
 
-lex.lex()
+# The lexer's table is generated once and kept in the cache, see cache.py
+def build_lexer():
+    import cache, os
+
+    path = cache.table_path("lextab", ".py")
+    if path is None:
+        return lex.lex()
+
+    if os.path.exists(path):
+        try:
+            return lex.lex(optimize=True, lextab=cache.load_module(path))
+        except Exception:
+            # Unreadable table (e.g. half written by a concurrent run), generated again
+            os.remove(path)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return lex.lex(optimize=True, lextab=name, outputdir=os.path.dirname(path))
+
+
+lexer = build_lexer()
 
 if __name__ == "__main__":
     with open(sys.argv[1]) as file:
@@ -0,0 +1,168 @@
+import AST
+import sys
+from time import perf_counter
+
+from errors import DesSineError
+
+###########################################
+# DesSine execution limits
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# Limits bound the statements a program executes, the segments it draws, the depth of its
+# routine calls and its running time, and let it be cancelled from another thread (or by a
+# signal). They are checked by the loops and the calls only, which every long running program
+# goes through: each iteration or call counts the statements of its block. Every engine checks
+# the limits of the run, if it has any (see RenderContext in interpreter.py).
+#
+# Checking is cheap: each step decrements a countdown, and the limits are only checked when it
+# reaches 0, at least every check_interval statements. Cancelling, or drawing a segment over the
+# limit, brings the countdown to 0 so that the program stops at its next step.
+
+# Statements executed between two checks of the limits
+check_interval = 1000
+
+# Exit status of the interpreter when a limit stopped the program
+limit_status = 3
+
+# Depth limit of the runs of the batch renderer and the render server, unless told otherwise
+default_depth = 10000
+
+# Python frames a routine call may take with the tree and closure engines, which run the calls
+# on python's stack: python's recursion limit is raised for the depth limit to be reached first
+frames_per_call = 16
+
+
+class LimitExceeded(DesSineError):
+    """
+    Raised at the loop or call where a limit was reached, which stops the program.
+    limit is the name of the limit: statements, segments, depth, time or cancel.
+    """
+
+    def __init__(self, limit, lineno, message):
+        super().__init__("Limit exceeded", lineno, message)
+        self.limit = limit
+
+
+def weight(block):
+    """
+    Returns the number of statements counted for running the given block once
+    """
+    # The statements of a block are the ones of its body
+    return max(1, sum(len(c.children) if isinstance(c, AST.BodyNode) else 1 for c in block.children))
+
+
+def allow_depth(depth):
+    """
+    Raises python's recursion limit, if needed, so that depth nested routine calls of the tree
+    and closure engines fit in it. It is never lowered, as other threads may be running deeper.
+    """
+    needed = depth * frames_per_call + 1000
+    if sys.getrecursionlimit() < needed:
+        sys.setrecursionlimit(needed)
+
+
+def stack_exhausted():
+    """
+    Returns the LimitExceeded stopping a program whose routine calls filled python's stack
+    (a RecursionError), which the tree and closure engines run them on
+    """
+    return LimitExceeded("depth", "-", "Too many nested routine calls for python's stack, "
+                                       "use --max-depth or the stack engine")
+
+
+class Limits:
+    """
+    Limits of a run, None meaning unlimited
+    """
+
+    def __init__(self, statements=None, segments=None, depth=None, time=None):
+        """
+        Args:
+            statements: number of statements executed in loops and routines
+            segments: number of segments drawn, the ones over the limit are dropped
+            depth: number of routine calls running at once
+            time: running time in seconds, counted from start()
+        """
+        self.max_statements = statements
+        self.max_segments = segments
+        self.max_depth = depth
+        self.max_time = time
+
+        self.executed = 0
+        self.drawn = 0
+        self.depth = 0
+        self.deadline = None
+        self.cancelled = False
+        self.quota = self.countdown = self.next_quota()
+
+    def watch(self, segments):
+        """
+        Counts the segments drawn in the given SegmentBuffer, if they are limited
+        """
+        if self.max_segments is not None:
+            segments.filters.insert(0, self.segment)
+
+    def start(self):
+        """
+        Starts the clock of the time limit
+        """
+        if self.max_time is not None:
+            self.deadline = perf_counter() + self.max_time
+
+    def cancel(self):
+        """
+        Stops the program at its next step, may be called from any thread or a signal handler
+        """
+        self.cancelled = True
+        self.countdown = 0
+
+    def next_quota(self):
+        if self.max_statements is None:
+            return check_interval
+        return max(1, min(check_interval, self.max_statements - self.executed))
+
+    def step(self, lineno, statements):
+        """
+        Counts the statements about to be run by a loop iteration or a call
+        """
+        self.countdown -= statements
+        if self.countdown <= 0:
+            self.check(lineno)
+
+    def check(self, lineno):
+        """
+        Raises LimitExceeded if a limit is reached, otherwise starts a new countdown
+        """
+        self.executed += self.quota - self.countdown
+
+        if self.cancelled:
+            raise LimitExceeded("cancel", lineno, "The program was cancelled")
+        if self.max_statements is not None and self.executed > self.max_statements:
+            raise LimitExceeded("statements", lineno, f"More than {self.max_statements} statements executed")
+        if self.max_segments is not None and self.drawn > self.max_segments:
+            raise LimitExceeded("segments", lineno, f"More than {self.max_segments} segments drawn")
+        if self.deadline is not None and perf_counter() > self.deadline:
+            raise LimitExceeded("time", lineno, f"Running for more than {self.max_time} seconds")
+
+        self.quota = self.countdown = self.next_quota()
+
+    def enter(self, lineno, statements):
+        """
+        Counts a routine call, and the statements of its block
+        """
+        self.depth += 1
+        if self.max_depth is not None and self.depth > self.max_depth:
+            raise LimitExceeded("depth", lineno, f"More than {self.max_depth} nested routine calls")
+        self.step(lineno, statements)
+
+    def segment(self, *segment):
+        """
+        Filter of the SegmentBuffer counting the segments drawn, it drops the ones over the limit
+        """
+        self.drawn += 1
+        if self.drawn > self.max_segments:
+            self.countdown = 0
+            return False
+        return True
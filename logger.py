@@ -53,4 +53,32 @@ def debug(variables):
     Args:
         variables: array of printable objects
     """
-    print(f"{bcolors.OKBLUE}[DesSine Debug] {bcolors.ENDC}{', '.join(map(lambda var: str(var), variables))}")
\ No newline at end of file
+    print(f"{bcolors.OKBLUE}[DesSine Debug] {bcolors.ENDC}{', '.join(map(lambda var: str(var), variables))}")
+
+def listing(line, message, highlight=False):
+    """
+    Prints a line of an annotated source listing
+
+    Args:
+        line: Number of the line
+        message: Annotated line to display
+        highlight: If True, the line stands out (e.g. a hot line of the profiler)
+    """
+    if highlight:
+        print(f"{bcolors.FAIL}{bcolors.BOLD}{line:>5} | {message}{bcolors.ENDC}")
+    else:
+        print(f"{line:>5} | {message}")
+
+def row(label, message, highlight=False):
+    """
+    Prints a row of a table, e.g. of the profiler report
+
+    Args:
+        label: Name of the row, aligned to the right
+        message: Columns to display after the label
+        highlight: If True, the row stands out, as in listing
+    """
+    if highlight:
+        print(f"{bcolors.FAIL}{bcolors.BOLD}{label:>40} {message}{bcolors.ENDC}")
+    else:
+        print(f"{label:>40} {message}")
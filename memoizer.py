@@ -0,0 +1,235 @@
+import AST
+from collections import namedtuple, OrderedDict
+
+from resolver import UNSET
+
+###########################################
+# DesSine routine memoizer
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# rotate and scale only ever multiply the vector, and move adds it to the position, so a call to
+# a routine that only draws draws the same shape whatever the position and vector it starts from,
+# up to a similarity. With the position p and the vector v as complex numbers, a point drawn at
+# p + v * z is recorded as z, and the call can be replayed from any other p' and v' as p' + v' * z.
+#
+# A routine can only be memoized if everything it does is captured by the record:
+#   - it only calls the built-ins that draw, move, rotate or scale (and pure ones like sin),
+#     so the color, the line width and the log are left alone
+#   - it (and the routines it calls) only reads its own variables, not the ones of its callers
+#   - none of the variables it assigns exists in a caller, as it would be updated there.
+#     Unlike the other rules, this one depends on the caller, so it is checked at each call.
+
+# Record of a call: the segments drawn, and the position and vector at the end of the call,
+# all relative to the position and vector at the start of the call
+Entry = namedtuple("Entry", ["segments", "position", "vector"])
+
+
+class Memoizer:
+    """
+    Cache of the calls to routines, by routine and arguments. The cached calls are bounded to
+    capacity segments in total, the least recently used ones being evicted first.
+    """
+
+    def __init__(self, state, segments, frames, replayable, capacity=1 << 20):
+        """
+        Args:
+            state: state of the RenderContext, holding the position, vector, color and line width
+            segments: SegmentBuffer the replayed segments are appended to
+            frames: frames of the variables of the running program
+            replayable: names of the built-ins a memoized routine may call
+        """
+        self.state = state
+        self.segments = segments
+        self.frames = frames
+        self.replayable = replayable
+        self.capacity = capacity
+
+        self.cache = OrderedDict()
+        self.size = 0
+        # Variables assigned by each routine and the ones it calls, None if it cannot be memoized
+        self.assigned = {}
+
+        # Segments drawn since the outermost call being recorded started, as complex numbers
+        self.recording = []
+        # Number of segments dropped from the start of the recording
+        self.dropped = 0
+        # Index in the recording of the start of each call being recorded,
+        # None for the calls which drew too many segments to be cached
+        self.starts = []
+
+        self.hits = 0
+        self.misses = 0
+
+    def call(self, routine, arguments, run):
+        """
+        Calls the routine with the given arguments, by replaying it if it is cached.
+        run(arguments) executes the call when it is not.
+        """
+        pending = self.begin(routine, arguments)
+        if pending is not None:
+            run(arguments)
+            self.end(pending)
+
+    def begin(self, routine, arguments):
+        """
+        Starts a call: if it is cached, replays it and returns None. Otherwise the call has to be
+        run, and then given to end() along with the returned value.
+        """
+        assigned = self.analyze(routine)
+        if assigned is None or self.shadowed(assigned):
+            return False
+
+        position = complex(*self.state["position"])
+        vector = complex(*self.state["vector"])
+        key = (routine, tuple(arguments))
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            self.replay(entry, position, vector)
+            return None
+
+        # Nothing drawn with a null vector can be brought back to its frame
+        if vector == 0:
+            return False
+
+        self.misses += 1
+        self.starts.append(self.dropped + len(self.recording))
+        return key, position, vector
+
+    def end(self, pending):
+        """
+        Ends a call which has been run, caching it if it was recorded
+        """
+        if pending is False:
+            return
+
+        key, position, vector = pending
+        start = self.starts.pop()
+        if start is not None:
+            self.store(key, self.recording[start - self.dropped:], position, vector)
+
+        if not self.starts:
+            self.recording.clear()
+            self.dropped = 0
+
+    def store(self, key, drawn, position, vector):
+        """
+        Caches the segments drawn by a call, and its effect on the position and vector
+        """
+        end_vector = complex(*self.state["vector"]) / vector
+        # A call which reduces the vector to 0 is run again, so that the warning is logged
+        if end_vector == 0:
+            return
+
+        end_position = (complex(*self.state["position"]) - position) / vector
+        drawn = [((a - position) / vector, (b - position) / vector) for a, b in drawn]
+        self.cache[key] = Entry(drawn, end_position, end_vector)
+        self.size += len(drawn) + 1
+
+        while self.size > self.capacity:
+            _, evicted = self.cache.popitem(last=False)
+            self.size -= len(evicted.segments) + 1
+
+    def replay(self, entry, position, vector):
+        """
+        Draws a cached call from the given position and vector, and moves the turtle accordingly
+        """
+        color = self.state["color"]
+        width = self.state["lineWidth"]
+        append = self.segments.append
+
+        for a, b in entry.segments:
+            a = position + vector * a
+            b = position + vector * b
+            append(a.real, a.imag, b.real, b.imag, color, width)
+            if self.starts:
+                self.record(a, b)
+
+        position += vector * entry.position
+        vector *= entry.vector
+        self.state["position"] = (position.real, position.imag)
+        self.state["vector"] = (vector.real, vector.imag)
+
+    def draw(self, x0, y0, x1, y1):
+        """
+        Called with each segment drawn, records it if a call is being recorded
+        """
+        if self.starts:
+            self.record(complex(x0, y0), complex(x1, y1))
+
+    def record(self, a, b):
+        self.recording.append((a, b))
+        if len(self.recording) > 2 * self.capacity:
+            self.trim()
+
+    def trim(self):
+        """
+        Gives up recording the calls which drew more segments than can be cached,
+        and drops what only they needed from the recording
+        """
+        total = self.dropped + len(self.recording)
+        self.starts = [None if start is None or total - start > self.capacity else start
+                       for start in self.starts]
+
+        # The calls being recorded are nested, so the ones still recorded are the last ones
+        live = [start for start in self.starts if start is not None]
+        keep = live[0] if live else total
+        del self.recording[:keep - self.dropped]
+        self.dropped = keep
+
+    def shadowed(self, assigned):
+        """
+        Tells whether one of the given variables is set in a frame of the callers
+        """
+        for frame in self.frames:
+            layout = frame[0]
+            if assigned.isdisjoint(layout):
+                continue
+            for name in assigned:
+                slot = layout.get(name)
+                if slot is not None and frame[slot] is not UNSET:
+                    return True
+        return False
+
+    def analyze(self, routine):
+        """
+        Returns the variables assigned by the routine and the routines it calls,
+        or None if it cannot be memoized
+        """
+        if routine not in self.assigned:
+            self.assigned[routine] = self.collect(routine)
+        return self.assigned[routine]
+
+    def collect(self, routine):
+        assigned = set()
+        routines = {routine}
+        stack = [routine.block]
+
+        while stack:
+            node = stack.pop()
+
+            if isinstance(node, AST.RoutineDefinitionNode):
+                return None
+            if isinstance(node, AST.FunctionNode) and node.action not in self.replayable:
+                return None
+            if isinstance(node, AST.TokenNode) and node.value is UNSET and node.slot is None:
+                # Variable of a caller
+                return None
+
+            if isinstance(node, AST.AssignNode):
+                assigned.add(node.children[0].tok)
+            elif isinstance(node, AST.RoutineCallNode):
+                # Routines defined several times are only known when called
+                if node.routine is None:
+                    return None
+                if node.routine not in routines:
+                    routines.add(node.routine)
+                    stack.append(node.routine.block)
+
+            stack.extend(node.children)
+
+        return frozenset(assigned)
@@ -0,0 +1,205 @@
+import AST
+from AST import addToClass
+
+from resolver import UNSET, frame_layout
+
+###########################################
+# DesSine optimizer
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# The optimizer rewrites the AST between the parser and the resolver:
+#   - operations and comparisons whose operands are all constants are replaced by their result,
+#     as are the calls to pure built-ins (sin) with constant arguments
+#   - if statements whose condition is constant are replaced by the branch taken, and while
+#     loops whose condition is constantly false are dropped
+#   - blocks declaring no variable are inlined in the enclosing body, so empty ones disappear
+#   - consecutive rotate / scale calls with constant arguments are merged into a single call
+#
+# Nothing that may fail at runtime is folded: a division by zero is left as it is, so that the
+# error is still reported at its original line.
+
+# Built-ins whose consecutive calls with constant arguments can be combined,
+# with the argument that makes a call useless
+merges = {
+    'rotate': (lambda x, y: x + y, 0),
+    'scale': (lambda x, y: x * y, 1),
+}
+
+
+class Optimizer:
+    """
+    What the optimizer needs to know from the interpreter to evaluate constant expressions
+    """
+
+    def __init__(self, operators, comparators, constants, built_ins):
+        self.operators = operators
+        self.comparators = comparators
+        self.constants = constants
+        self.built_ins = built_ins
+
+    def value(self, node):
+        """
+        Returns the value of the given node if it is a constant, UNSET otherwise
+        """
+        if not isinstance(node, AST.TokenNode):
+            return UNSET
+        if not isinstance(node.tok, str):
+            return node.tok
+        return self.constants.get(node.tok, UNSET)
+
+    def fold(self, node, evaluate):
+        """
+        Replaces the node with its value if all its children are constants.
+        Operations raising an error (e.g. dividing by zero) are kept, so that they fail at runtime.
+        """
+        values = [self.value(c) for c in node.children]
+        if UNSET in values:
+            return node
+
+        try:
+            return AST.TokenNode(node.lineno, evaluate(values))
+        except ArithmeticError:
+            return node
+
+
+def optimize_program(program, operators, comparators, constants, built_ins):
+    """
+    Optimizes the given ProgramNode in place
+    """
+    program.optimize(Optimizer(operators, comparators, constants, built_ins))
+
+
+@addToClass(AST.Node)
+def optimize(self, optimizer):
+    self.children = [c.optimize(optimizer) for c in self.children]
+    return self
+
+
+@addToClass(AST.BodyNode)
+def optimize(self, optimizer):
+    statements = []
+
+    for c in self.children:
+        c = c.optimize(optimizer)
+
+        # Blocks declaring no variable are only there for the scope, their statements can be
+        # run in the enclosing one. Blocks that do declare variables keep their own frame.
+        if isinstance(c, AST.BlockNode) and frame_layout(c.children) is None:
+            for body in c.children:
+                statements.extend(body.children)
+        elif c is not None:
+            statements.append(c)
+
+    self.children = []
+    for statement in statements:
+        merge(self.children, statement, optimizer)
+
+    return self
+
+
+def merge(statements, statement, optimizer):
+    """
+    Appends the statement to the given list, merging it with the previous one if they are
+    calls to the same built-in from merges with constant arguments
+    """
+    if not isinstance(statement, AST.FunctionNode) or statement.action not in merges:
+        statements.append(statement)
+        return
+
+    combine, identity = merges[statement.action]
+    value = optimizer.value(statement.children[0]) if len(statement.children) == 1 else UNSET
+
+    previous = statements[-1] if statements else None
+    if value is not UNSET and isinstance(previous, AST.FunctionNode) and previous.action == statement.action:
+        previous_value = optimizer.value(previous.children[0]) if len(previous.children) == 1 else UNSET
+        if previous_value is not UNSET:
+            statements.pop()
+            value = combine(previous_value, value)
+            statement = AST.FunctionNode(previous.lineno, statement.action, [AST.TokenNode(previous.lineno, value)])
+
+    # Calls that leave the vector unchanged are dropped altogether
+    if value is not UNSET and value == identity:
+        return
+
+    statements.append(statement)
+
+
+@addToClass(AST.BlockNode)
+def optimize(self, optimizer):
+    for c in self.children:
+        c.optimize(optimizer)
+
+    # Blocks whose statements have all been optimized away end up empty, like {}
+    if self.children and not self.children[0].children:
+        self.children = []
+
+    return self
+
+
+@addToClass(AST.RoutineDefinitionNode)
+def optimize(self, optimizer):
+    self.block = self.block.optimize(optimizer)
+    return self
+
+
+@addToClass(AST.OpNode)
+def optimize(self, optimizer):
+    self.children = [c.optimize(optimizer) for c in self.children]
+    operator = optimizer.operators[self.op]
+
+    # Unary operators behave like a binary operation with 0 as left operand
+    if len(self.children) == 1:
+        return optimizer.fold(self, lambda values: operator(0, values[0]))
+
+    return optimizer.fold(self, lambda values: operator(values[0], values[1]))
+
+
+@addToClass(AST.ComparisonNode)
+def optimize(self, optimizer):
+    self.children = [c.optimize(optimizer) for c in self.children]
+    comparator = optimizer.comparators[self.operator]
+    return optimizer.fold(self, lambda values: comparator(values[0], values[1]))
+
+
+@addToClass(AST.FunctionNode)
+def optimize(self, optimizer):
+    self.children = [c.optimize(optimizer) for c in self.children]
+
+    # Only the built-ins without side effects can be evaluated beforehand, and only if they are
+    # called correctly: the resolver reports the bad calls later
+    function = optimizer.built_ins[self.action]
+    if not function.pure or function.arity != len(self.children):
+        return self
+
+    return optimizer.fold(self, function.method)
+
+
+@addToClass(AST.IfNode)
+def optimize(self, optimizer):
+    self.children = [c.optimize(optimizer) for c in self.children]
+    condition = optimizer.value(self.children[0])
+
+    if condition is UNSET:
+        # An empty else has nothing to run
+        if len(self.children) > 2 and not self.children[2].children:
+            self.children.pop()
+        return self
+
+    # The branch taken is known, the if is replaced by its block
+    if condition:
+        return self.children[1]
+    if len(self.children) > 2:
+        return self.children[2]
+    return None
+
+
+@addToClass(AST.WhileNode)
+def optimize(self, optimizer):
+    self.children = [c.optimize(optimizer) for c in self.children]
+    condition = optimizer.value(self.children[0])
+
+    if condition is not UNSET and not condition:
+        return None
+    return self
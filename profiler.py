@@ -0,0 +1,252 @@
+import AST
+import json, threading
+from time import perf_counter
+
+import logger
+
+###########################################
+# DesSine profiler
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# The profiler replaces the execute (or compile) methods of the nodes with measuring ones while
+# it is enabled, so that running without it costs nothing at all. The methods are the ones of
+# every program run by the process, so only one of them is profiled at a time, and the nodes of
+# the others (run on other threads) are not measured.
+#
+# The time of a node is its own time: the time spent in its children is counted for them.
+# Segments are counted for the innermost routine running when they are drawn (or for the main
+# program), and in total for every routine, including the ones it calls.
+
+# Nodes which are measured, blocks and bodies have no line of their own
+profiled = (
+    AST.InitNode,
+    AST.RoutineDefinitionNode,
+    AST.RoutineCallNode,
+    AST.TokenNode,
+    AST.OpNode,
+    AST.ComparisonNode,
+    AST.AssignNode,
+    AST.WhileNode,
+    AST.IfNode,
+    AST.ForNode,
+    AST.FunctionNode,
+)
+
+# Nodes which are part of a statement
+expressions = (AST.TokenNode, AST.OpNode, AST.ComparisonNode)
+
+# Name under which the segments drawn outside of any routine are counted
+main_routine = "(main)"
+
+# Lines taking at least this share of the time are highlighted in the listing
+hot_share = 0.05
+
+# Held by the enabled profiler
+lock = threading.Lock()
+
+
+def node_kind(node):
+    """
+    Returns the name under which a node is counted: its class, with the built-in or routine it calls
+    """
+    kind = type(node).__name__
+    if isinstance(node, (AST.FunctionNode, AST.InitNode)):
+        return f"{kind}({node.action})"
+    if isinstance(node, AST.RoutineCallNode):
+        return f"{kind}({node.name})"
+    return kind
+
+
+class Profiler:
+    """
+    Counts the executions of each node and the time spent in it, and the segments drawn by routine
+    """
+
+    def __init__(self):
+        # Node -> [executions, own time]
+        self.nodes = {}
+        # Routine name -> [calls, segments drawn by itself, segments drawn in total]
+        self.routines = {main_routine: [1, 0, 0]}
+        # Time spent in the children of the node being executed
+        self.children = 0
+        # Routines being run, innermost last, and the number of segments drawn when entering each
+        self.calls = [(main_routine, 0)]
+        # Number of calls being run, by routine
+        self.active = {}
+        self.segments = 0
+        self.elapsed = 0
+        self.originals = []
+        self.context = None
+
+    def enable(self, context, method="execute"):
+        """
+        Starts measuring the nodes run in the given RenderContext, whose method (execute for the
+        tree engine, compile for the closure engine) is replaced by a measuring one. Waits for
+        the profiler of another run to be disabled, if any.
+        """
+        lock.acquire()
+        self.context = context
+        context.segments.filters.insert(0, self.segment)
+
+        if method == "compile":
+            # The nodes only get their compile methods once the compiler is imported
+            import compiler
+
+        for cls in profiled:
+            original = cls.__dict__[method]
+            self.originals.append((cls, method, original))
+            setattr(cls, method, self.measure_compile(original) if method == "compile" else self.measure_execute(original))
+
+    def disable(self):
+        """
+        Puts the original methods back
+        """
+        for cls, method, original in self.originals:
+            setattr(cls, method, original)
+        self.originals = []
+        lock.release()
+
+    def measure_execute(self, execute):
+        profiler = self
+
+        def measured(node, context):
+            if context is not profiler.context:
+                return execute(node, context)
+            return profiler.measure(node, execute, node, context)
+        return measured
+
+    def measure_compile(self, compile):
+        profiler = self
+
+        def measured(node, env, routines):
+            run = compile(node, env, routines)
+            if env.frames is not profiler.context.frames:
+                return run
+            return lambda: profiler.measure(node, run)
+        return measured
+
+    def measure(self, node, run, *args):
+        """
+        Runs a node, counting its execution and the time spent in it
+        """
+        stats = self.nodes.get(node)
+        if stats is None:
+            stats = self.nodes[node] = [0, 0]
+
+        call = isinstance(node, AST.RoutineCallNode)
+        if call:
+            self.enter(node.name)
+
+        children = self.children
+        self.children = 0
+        start = perf_counter()
+        try:
+            return run(*args)
+        finally:
+            elapsed = perf_counter() - start
+            stats[0] += 1
+            stats[1] += elapsed - self.children
+            self.children = children + elapsed
+            if call:
+                self.leave()
+
+    def enter(self, name):
+        routine = self.routines.setdefault(name, [0, 0, 0])
+        routine[0] += 1
+        self.calls.append((name, self.segments))
+        self.active[name] = self.active.get(name, 0) + 1
+
+    def leave(self):
+        name, segments = self.calls.pop()
+        self.active[name] -= 1
+        # Recursive calls are already counted by the outermost one
+        if self.active[name] == 0:
+            self.routines[name][2] += self.segments - segments
+
+    def segment(self, *segment):
+        """
+        Filter of the SegmentBuffer counting the segments drawn, it keeps them all
+        """
+        self.segments += 1
+        self.routines[self.calls[-1][0]][1] += 1
+        return True
+
+    def run(self, execute):
+        """
+        Runs the program, measuring its total time
+        """
+        start = perf_counter()
+        try:
+            execute()
+        finally:
+            self.elapsed += perf_counter() - start
+            self.routines[main_routine][2] = self.segments
+
+    def by_line(self):
+        """
+        Returns {line: [executions, time]}, a line's executions being the ones of its most
+        executed statement (or expression, if there is no statement on the line)
+        """
+        lines = {}
+        for node, (count, time) in self.nodes.items():
+            line = lines.setdefault(node.lineno, [0, 0, 0])
+            if isinstance(node, expressions):
+                line[1] = max(line[1], count)
+            else:
+                line[0] = max(line[0], count)
+            line[2] += time
+        return {number: [statements or values, time] for number, (statements, values, time) in lines.items()}
+
+    def by_kind(self):
+        """
+        Returns {kind: [executions, time]}, see node_kind
+        """
+        kinds = {}
+        for node, (count, time) in self.nodes.items():
+            kind = kinds.setdefault(node_kind(node), [0, 0])
+            kind[0] += count
+            kind[1] += time
+        return kinds
+
+    def report(self, source):
+        """
+        Prints the source annotated with the executions and time of each line, the hot ones
+        highlighted, followed by the time by kind of node and the segments by routine
+        """
+        total = self.elapsed or 1
+        lines = self.by_line()
+
+        logger.info("Profile", f"{self.elapsed * 1000:.1f} ms, {self.segments} segments")
+        for number, text in enumerate(source.splitlines(), 1):
+            if number in lines:
+                count, time = lines[number]
+                share = time / total
+                annotation = f"{count:>10} {time * 1000:>10.2f} ms {share:>6.1%}"
+                logger.listing(number, f"{annotation} | {text}", share >= hot_share)
+            else:
+                logger.listing(number, f"{'':>31} | {text}")
+
+        logger.info("Profile", "Nodes by own time")
+        for kind, (count, time) in sorted(self.by_kind().items(), key=lambda item: -item[1][1]):
+            logger.row(kind, f"{count:>10} {time * 1000:>10.2f} ms {time / total:>6.1%}")
+
+        logger.info("Profile", "Segments by routine (own, total)")
+        for name, (calls, own, inclusive) in sorted(self.routines.items(), key=lambda item: -item[1][2]):
+            logger.row(name, f"{calls:>10} calls {own:>10} {inclusive:>10}")
+
+    def write_json(self, path):
+        """
+        Writes the measures to a JSON file
+        """
+        data = {
+            "time": self.elapsed,
+            "segments": self.segments,
+            "lines": {str(line): {"count": count, "time": time} for line, (count, time) in sorted(self.by_line().items())},
+            "nodes": {kind: {"count": count, "time": time} for kind, (count, time) in self.by_kind().items()},
+            "routines": {name: {"calls": calls, "segments": own, "total_segments": inclusive}
+                         for name, (calls, own, inclusive) in self.routines.items()},
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
@@ -0,0 +1,386 @@
+import numpy as np
+import struct, zlib
+
+###########################################
+# DesSine headless rasterizer
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# Named colors the interpreter may use before any color is set
+named_colors = {
+    "black": (0, 0, 0),
+    "white": (255, 255, 255),
+}
+
+# Maximum number of (sample, pixel) pairs handled at once, bounds the memory used per chunk
+chunk_budget = 1 << 22
+
+# Length in pixels above which segments are cut to their part near the image before being drawn,
+# as their distances to the pixels would not fit the float32 used to measure them
+long_segment = 1 << 20
+
+
+def to_rgb(color):
+    """
+    Converts a TKinter compliant color ("#rrggbb" or a known name) into an (r, g, b) tuple
+    """
+    if color in named_colors:
+        return named_colors[color]
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def rasterize(segments, width, height, background, colors, antialias=True):
+    """
+    Rasterizes the segments of a SegmentBuffer into a (height, width, 3) RGB image of uint8.
+
+    Args:
+        segments: SegmentBuffer holding the drawing
+        background: (r, g, b) tuple filling the image
+        colors: (r, g, b) tuples matching the color palette of the buffer
+        antialias: if False, pixels are either fully covered or not at all
+    """
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[:] = np.asarray(background, dtype=np.float32) / 255
+
+    # Palettes are small, so they are converted once and indexed by each chunk
+    colors = np.array(colors, dtype=np.float32).reshape(-1, 3)
+    widths = np.array(segments.widths, dtype=np.float64)
+
+    for chunk in segments.chunks:
+        if len(chunk):
+            color = np.frombuffer(chunk.color, dtype=chunk.color.typecode)
+            width = np.frombuffer(chunk.width, dtype=chunk.width.typecode)
+            draw_segments(image, 0, 0, chunk.x0, chunk.y0, chunk.x1, chunk.y1, colors[color], widths[width], antialias)
+
+    return (image * 255 + 0.5).astype(np.uint8)
+
+
+def draw_segments(image, left, top, x0, y0, x1, y1, colors, widths, antialias=True):
+    """
+    Draws the segments, in order, into the float image whose top left pixel is at (left, top).
+    Segments are processed by runs of identical width, split so that each chunk stays in budget.
+    """
+    x0, y0, x1, y1 = (np.asarray(a, dtype=np.float64) for a in (x0, y0, x1, y1))
+    colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3) / 255
+    widths = np.asarray(widths, dtype=np.float64)
+
+    # Only the part of a segment which may cover a pixel of the image is sampled, however long
+    # the segment is. Pixels can be covered up to radius + 0.5 away from it.
+    height, width = image.shape[:2]
+    margin = np.maximum(widths, 1) / 2 + 1
+    visible, t0, t1 = clip_segments(x0, y0, x1, y1, left - margin, top - margin,
+                                    left + width + margin, top + height + margin)
+    if not visible.all():
+        x0, y0, x1, y1, t0, t1, colors, widths = (a[visible] for a in (x0, y0, x1, y1, t0, t1, colors, widths))
+    if len(x0) == 0:
+        return
+
+    length = np.hypot(x1 - x0, y1 - y0)
+    samples = np.ceil(length * (t1 - t0)).astype(np.int64) + 1
+
+    cut = length > long_segment
+    if cut.any():
+        dx = x1 - x0
+        dy = y1 - y0
+        x0, y0, x1, y1 = (np.where(cut, x0 + t0 * dx, x0), np.where(cut, y0 + t0 * dy, y0),
+                          np.where(cut, x0 + t1 * dx, x1), np.where(cut, y0 + t1 * dy, y1))
+        t0 = np.where(cut, 0, t0)
+        t1 = np.where(cut, 1, t1)
+
+    # Boundaries of the runs of segments sharing the same width
+    changes = np.flatnonzero(widths[1:] != widths[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [len(x0)]))
+
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        radius = max(float(widths[start]), 1) / 2
+        reach = footprint_reach(radius)
+        per_chunk = max(1, chunk_budget // (2 * reach + 1) ** 2)
+
+        # Split the run so that the total number of samples of a chunk stays under per_chunk
+        cumulative = np.cumsum(samples[start:stop])
+        position = 0
+        done = 0
+        while position < len(cumulative):
+            end = max(position + 1, int(np.searchsorted(cumulative, done + per_chunk, side="right")))
+            s = slice(start + position, start + end)
+            draw_chunk(image, left, top, x0[s], y0[s], x1[s], y1[s], t0[s], t1[s], colors[s], samples[s],
+                       radius, reach, antialias)
+            done = cumulative[end - 1]
+            position = end
+
+
+def clip_segments(x0, y0, x1, y1, xmin, ymin, xmax, ymax):
+    """
+    Clips the segments to the given rectangles (one per segment), with the Liang-Barsky algorithm.
+    Returns whether each segment overlaps its rectangle, and where its part inside of it starts
+    and ends, as fractions of the segment.
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    # Part of each segment inside the rectangle, from t0 to t1 along it
+    t0 = np.zeros_like(dx)
+    t1 = np.ones_like(dx)
+    # Segments with infinite or NaN coordinates, or too long for their length to be a float, are
+    # dropped (e.g. after a scale overflowing)
+    with np.errstate(over="ignore", invalid="ignore"):
+        visible = np.isfinite(np.hypot(dx, dy)) & np.isfinite(x0) & np.isfinite(y0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+            # Segments parallel to an edge are either inside of it or not at all
+            visible &= (p != 0) | (q >= 0)
+            ratio = q / p
+            t0 = np.where(p < 0, np.maximum(t0, ratio), t0)
+            t1 = np.where(p > 0, np.minimum(t1, ratio), t1)
+    visible &= t0 <= t1
+
+    return visible, t0, t1
+
+
+def footprint_reach(radius):
+    """
+    Returns how many pixels around a sample may be covered by a line of the given radius.
+    Samples are at most 1 pixel apart, so any pixel whose center lies within radius + 0.5 of
+    the segment is within sqrt((radius + 0.5)² + 0.5²) of a sample.
+    """
+    return int(np.floor(np.hypot(radius + 0.5, 0.5) + 0.5))
+
+
+def draw_chunk(image, left, top, x0, y0, x1, y1, t0, t1, colors, samples, radius, reach, antialias):
+    """
+    Rasterizes a chunk of segments of the same width, compositing them over the image. Only the
+    part of each segment from t0 to t1 (fractions of the segment) is sampled, the distances to
+    the pixels are measured to the whole segment.
+    """
+    height, width = image.shape[:2]
+    x0 = x0 - left
+    y0 = y0 - top
+    dx = x1 - left - x0
+    dy = y1 - top - y0
+    length2 = dx * dx + dy * dy
+    inverse2 = np.divide(1, length2, out=np.zeros_like(length2), where=length2 > 0)
+
+    # Sample each segment every pixel at most
+    segment = np.repeat(np.arange(len(x0)), samples)
+    first = np.repeat(np.cumsum(samples) - samples, samples)
+    t = (np.arange(len(segment)) - first) / np.maximum(samples - 1, 1)[segment]
+    t = t0[segment] + t * (t1 - t0)[segment]
+    sx = np.floor(x0[segment] + t * dx[segment]).astype(np.int32)
+    sy = np.floor(y0[segment] + t * dy[segment]).astype(np.int32)
+
+    # Pixels around each sample
+    offsets = np.arange(-reach, reach + 1, dtype=np.int32)
+    ox, oy = np.meshgrid(offsets, offsets)
+    px = (sx[:, None] + ox.ravel()).ravel()
+    py = (sy[:, None] + oy.ravel()).ravel()
+    segment = np.repeat(segment, ox.size)
+
+    inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+    px, py, segment = px[inside], py[inside], segment[inside]
+
+    # Distance between the pixel centers and their segment
+    wx = (px + 0.5 - x0[segment]).astype(np.float32)
+    wy = (py + 0.5 - y0[segment]).astype(np.float32)
+    sdx = dx[segment].astype(np.float32)
+    sdy = dy[segment].astype(np.float32)
+    u = (wx * sdx + wy * sdy) * inverse2[segment].astype(np.float32)
+    np.clip(u, 0, 1, out=u)
+    wx -= u * sdx
+    wy -= u * sdy
+    distance = np.sqrt(wx * wx + wy * wy)
+
+    if antialias:
+        coverage = np.clip(np.float32(radius + 0.5) - distance, 0, 1)
+    else:
+        coverage = (distance <= radius).astype(np.float32)
+
+    covered = coverage > 0
+    pixel = (py.astype(np.int64) * width + px)[covered]
+    coverage = coverage[covered]
+    segment = segment[covered]
+    if len(pixel) == 0:
+        return
+
+    # For each pixel, keep the best coverage and the color of the last segment drawn on it.
+    # Segments are already in drawing order, so a stable sort keeps them ordered per pixel.
+    order = np.argsort(pixel, kind="stable")
+    pixel, coverage, segment = pixel[order], coverage[order], segment[order]
+    starts = np.flatnonzero(np.concatenate(([True], pixel[1:] != pixel[:-1])))
+    ends = np.concatenate((starts[1:], [len(pixel)])) - 1
+    alpha = np.maximum.reduceat(coverage, starts)[:, None]
+    color = colors[segment[ends]]
+    pixel = pixel[starts]
+
+    flat = image.reshape(-1, 3)
+    flat[pixel] = flat[pixel] * (1 - alpha) + color * alpha
+
+
+def rasterize_tiles(segments, width, height, background, colors, antialias=True, tile_size=1024, jobs=None):
+    """
+    Same as rasterize, but the image is split into square tiles of tile_size pixels which are
+    rasterized in parallel by a pool of jobs processes (one per core by default).
+
+    Each segment is binned into the tiles its bounding box (widened by its width) overlaps,
+    keeping the drawing order in each tile. The segments, the bins and the image are all in
+    shared memory: the workers only receive the range of their tile's bin, and write the
+    pixels of their tile straight into the final image.
+    """
+    from multiprocessing import Pool
+    from multiprocessing.shared_memory import SharedMemory
+
+    count = sum(len(chunk) for chunk in segments.chunks)
+    columns = (width + tile_size - 1) // tile_size
+    rows = (height + tile_size - 1) // tile_size
+
+    shared = []
+    names = []
+
+    def allocate(shape, dtype):
+        dtype = np.dtype(dtype)
+        memory = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        shared.append(memory)
+        names.append((memory.name, shape, dtype.str))
+        return np.ndarray(shape, dtype, memory.buf)
+
+    try:
+        # x0, y0, x1, y1 and width of each segment, then the index of its color
+        geometry = allocate((5, count), np.float64)
+        color = allocate((count,), np.uint32)
+        widths = np.array(segments.widths, dtype=np.float64)
+        position = 0
+        for chunk in segments.chunks:
+            n = len(chunk)
+            for row, values in enumerate((chunk.x0, chunk.y0, chunk.x1, chunk.y1)):
+                geometry[row, position:position + n] = np.frombuffer(values, dtype=values.typecode)
+            geometry[4, position:position + n] = widths[np.frombuffer(chunk.width, dtype=chunk.width.typecode)]
+            color[position:position + n] = np.frombuffer(chunk.color, dtype=chunk.color.typecode)
+            position += n
+
+        tile, bins = bin_segments(geometry, columns, rows, tile_size)
+        index = allocate(bins.shape, bins.dtype)
+        index[:] = bins
+        bounds = np.searchsorted(tile, np.arange(columns * rows + 1))
+
+        # Tiles no segment overlaps are left with the background
+        image = allocate((height, width, 3), np.uint8)
+        image[:] = background
+
+        palette = np.array(colors, dtype=np.float32).reshape(-1, 3)
+        state = (names, palette, tuple(background), width, height, tile_size, antialias)
+        tasks = [(t, bounds[t], bounds[t + 1]) for t in range(columns * rows) if bounds[t] < bounds[t + 1]]
+
+        if jobs == 1:
+            attach_tiles(*state)
+            for task in tasks:
+                draw_tile(task)
+        else:
+            with Pool(jobs, initializer=attach_tiles, initargs=state) as pool:
+                for _ in pool.imap_unordered(draw_tile, tasks):
+                    pass
+
+        return image.copy()
+    finally:
+        # The views on the shared memory must be released before closing it
+        geometry = color = index = image = None
+        memories = tile_state.pop("memories", [])
+        tile_state.clear()
+        for memory in memories:
+            memory.close()
+        for memory in shared:
+            memory.close()
+            memory.unlink()
+
+
+def bin_segments(geometry, columns, rows, tile_size):
+    """
+    Returns the tiles overlapped by the bounding box of each segment, sorted, along with the
+    index of the segment in each of them. Segments stay in drawing order within a tile.
+    """
+    x0, y0, x1, y1, widths = geometry
+    # Pixels can be covered up to radius + 0.5 away from the segment
+    margin = np.maximum(widths, 1) / 2 + 1
+    left = np.floor((np.minimum(x0, x1) - margin) / tile_size)
+    right = np.floor((np.maximum(x0, x1) + margin) / tile_size)
+    top = np.floor((np.minimum(y0, y1) - margin) / tile_size)
+    bottom = np.floor((np.maximum(y0, y1) + margin) / tile_size)
+
+    # Segments entirely outside of the image are not drawn at all
+    visible = np.flatnonzero((right >= 0) & (left < columns) & (bottom >= 0) & (top < rows))
+    left = np.clip(left[visible], 0, columns - 1).astype(np.int64)
+    right = np.clip(right[visible], 0, columns - 1).astype(np.int64)
+    top = np.clip(top[visible], 0, rows - 1).astype(np.int64)
+    bottom = np.clip(bottom[visible], 0, rows - 1).astype(np.int64)
+
+    across = right - left + 1
+    counts = across * (bottom - top + 1)
+    segment = np.repeat(np.arange(len(visible)), counts)
+    k = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile = (top[segment] + k // across[segment]) * columns + left[segment] + k % across[segment]
+
+    order = np.argsort(tile, kind="stable")
+    return tile[order], visible[segment[order]]
+
+
+# Shared arrays of the rasterization, as seen by a worker process
+tile_state = {}
+
+
+def attach_tiles(names, palette, background, width, height, tile_size, antialias):
+    """
+    Initializes a worker of rasterize_tiles, mapping the shared arrays
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    tile_state.clear()
+    memories = [SharedMemory(name=name) for name, _, _ in names]
+    geometry, color, index, image = (np.ndarray(shape, np.dtype(dtype), memory.buf)
+                                     for memory, (_, shape, dtype) in zip(memories, names))
+    tile_state.update(memories=memories, geometry=geometry, color=color, index=index, image=image,
+                      palette=palette, background=background, width=width, height=height,
+                      tile_size=tile_size, antialias=antialias)
+
+
+def draw_tile(task):
+    """
+    Rasterizes the segments of the given (tile, start, stop) bin into the shared image
+    """
+    tile, start, stop = task
+    state = tile_state
+    columns = (state["width"] + state["tile_size"] - 1) // state["tile_size"]
+    left = tile % columns * state["tile_size"]
+    top = tile // columns * state["tile_size"]
+    right = min(left + state["tile_size"], state["width"])
+    bottom = min(top + state["tile_size"], state["height"])
+
+    pixels = np.empty((bottom - top, right - left, 3), dtype=np.float32)
+    pixels[:] = np.asarray(state["background"], dtype=np.float32) / 255
+
+    index = state["index"][start:stop]
+    x0, y0, x1, y1, widths = state["geometry"][:, index]
+    colors = state["palette"][state["color"][index]]
+    draw_segments(pixels, left, top, x0, y0, x1, y1, colors, widths, state["antialias"])
+
+    state["image"][top:bottom, left:right] = (pixels * 255 + 0.5).astype(np.uint8)
+
+
+def write_png(path, image):
+    """
+    Writes a (height, width, 3) uint8 image as a PNG file, using only the standard library
+    """
+    height, width = image.shape[:2]
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    # Every row starts with its filter type (0, no filter)
+    rows = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 0] = 0
+    rows[:, 1:] = image.reshape(height, width * 3)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
@@ -0,0 +1,291 @@
+import AST
+from AST import addToClass
+from collections import namedtuple
+
+from errors import DesSineError, ProgramErrors
+
+###########################################
+# DesSine resolver
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# The resolver runs once over the AST before execution.
+#
+# Variables live in frames: the program has one, each block declaring variables has one,
+# and each call of a routine with parameters has one for them. A frame is a list whose first
+# item is its layout (name -> slot) and whose other items are the values of the variables.
+# Every identifier is resolved to the (depth, slot) of the nearest enclosing frame that may hold
+# it, so that reading it is an index operation.
+#
+# A slot stays UNSET until the variable is assigned, and routines can read the variables of
+# their callers, so when the slot is UNSET (or when no enclosing frame declares the name),
+# the frames are scanned by name exactly like the scopes were, from the innermost one.
+
+class Unset:
+    """
+    Value of the slots of the variables not assigned yet
+    """
+    def __repr__(self):
+        return "UNSET"
+
+UNSET = Unset()
+
+# Static view of the frames enclosing a node, and whether it is in the body of a routine
+StaticScope = namedtuple("StaticScope", ["layouts", "in_routine"])
+
+
+class Resolution:
+    """
+    What the resolver knows about the whole program
+    """
+
+    def __init__(self, program, built_ins, constants, partial=False):
+        """
+        Args:
+            program: tree of the program, or of its first part
+            partial: the program is resolved one part at a time (see stream.py), the routines
+                and variables declared in the parts to come are not known yet
+        """
+        self.built_ins = built_ins
+        self.constants = constants
+        self.partial = partial
+        self.definitions = {}
+        self.declared = set()
+        self.errors = []
+        self.declare(program)
+
+    def declare(self, tree):
+        """
+        Records the routines and variables declared in the given tree
+        """
+        for node in walk(tree):
+            if isinstance(node, AST.RoutineDefinitionNode):
+                self.definitions.setdefault(node.name, []).append(node)
+                self.declared.update(node.params)
+            elif isinstance(node, AST.AssignNode):
+                self.declared.add(node.children[0].tok)
+
+    def error(self, lineno, message):
+        self.errors.append((lineno, message))
+
+
+def walk(node):
+    """
+    Yields all the nodes of the tree, including the bodies of the routines
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children))
+        if isinstance(node, AST.RoutineDefinitionNode):
+            stack.append(node.block)
+
+
+def resolve_program(program, built_ins, constants):
+    """
+    Resolves the variables and calls of the program, and raises ProgramErrors with every
+    undefined name or bad number of arguments before anything is executed
+    """
+    resolution = Resolution(program, built_ins, constants)
+    program.resolve(resolution, None)
+    check(resolution)
+
+
+def resolve_statements(statements, frame, resolution):
+    """
+    Resolves top-level statements of a program resolved one part at a time, in the frame of the
+    program, which gets a slot for each variable they declare. Raises ProgramErrors like
+    resolve_program.
+    """
+    for statement in statements:
+        resolution.declare(statement)
+
+    layout = frame[0]
+    for name in frame_layout(statements) or ():
+        if name not in layout:
+            layout[name] = len(layout) + 1
+            frame.append(UNSET)
+
+    scope = StaticScope((layout,), False)
+    for statement in statements:
+        statement.resolve(resolution, scope)
+    check(resolution)
+
+
+def check(resolution):
+    if resolution.errors:
+        raise ProgramErrors([DesSineError("Semantic error", lineno, message)
+                             for lineno, message in sorted(resolution.errors, key=lambda e: e[0])])
+
+
+def frame_layout(nodes):
+    """
+    Returns the layout of the frame holding the variables assigned directly by the given
+    statements (not in their nested blocks), or None if there are none
+    """
+    layout = {}
+
+    def collect(nodes):
+        for node in nodes:
+            if isinstance(node, AST.AssignNode):
+                layout.setdefault(node.children[0].tok, len(layout) + 1)
+            elif isinstance(node, AST.ForNode):
+                # The init and increment of a for loop are run in the enclosing frame
+                collect([node.children[0], node.children[2]])
+            elif isinstance(node, AST.BodyNode):
+                collect(node.children)
+
+    collect(nodes)
+    return layout or None
+
+
+def new_frame(layout):
+    """
+    Returns a frame of the given layout, with all its variables unset
+    """
+    return [layout] + [UNSET] * len(layout)
+
+
+@addToClass(AST.Node)
+def resolve(self, resolution, scope):
+    for c in self.children:
+        c.resolve(resolution, scope)
+
+
+@addToClass(AST.ProgramNode)
+def resolve(self, resolution, scope):
+    # The program frame always exists, even if it is empty
+    layout = frame_layout(self.children[1:]) or {}
+    self.frame = new_frame(layout)
+
+    scope = StaticScope((layout,), False)
+    for c in self.children:
+        c.resolve(resolution, scope)
+
+
+@addToClass(AST.BlockNode)
+def resolve(self, resolution, scope):
+    layout = frame_layout(self.children)
+
+    # Blocks declaring no variable do not need a frame
+    if layout is not None:
+        self.frame = new_frame(layout)
+        scope = StaticScope(scope.layouts + (layout,), scope.in_routine)
+
+    for c in self.children:
+        c.resolve(resolution, scope)
+
+
+@addToClass(AST.RoutineDefinitionNode)
+def resolve(self, resolution, scope):
+    # The frame of the parameters is the outermost frame of the routine
+    self.layout = {param: i + 1 for i, param in enumerate(self.params)} or None
+    layouts = (self.layout,) if self.layout else ()
+    self.block.resolve(resolution, StaticScope(layouts, True))
+
+
+@addToClass(AST.RoutineCallNode)
+def resolve(self, resolution, scope):
+    definitions = resolution.definitions.get(self.name, [])
+
+    # In a program resolved one part at a time, the routine may be defined (again) further, so
+    # calls are always looked up when run
+    if not resolution.partial:
+        if not definitions:
+            resolution.error(self.lineno, f"No function with name '{self.name}' exists.")
+        elif len(definitions) == 1:
+            # The call is linked to the only routine of that name once and for all
+            self.routine = definitions[0]
+            if len(self.routine.params) != len(self.children):
+                resolution.error(self.lineno, f"Bad number of arguments in '{self.name}' call.")
+        # A routine defined several times is looked up when called, as the definition run last wins
+
+    for c in self.children:
+        c.resolve(resolution, scope)
+
+
+@addToClass(AST.TokenNode)
+def resolve(self, resolution, scope):
+    if not isinstance(self.tok, str):
+        self.value = self.tok
+        return
+
+    if self.tok in resolution.constants:
+        self.value = resolution.constants[self.tok]
+        return
+
+    self.value = UNSET
+    for depth, layout in enumerate(reversed(scope.layouts)):
+        if self.tok in layout:
+            self.depth = depth
+            self.slot = layout[self.tok]
+            return
+
+    # Outside of routines, the enclosing frames are all the frames there will be at runtime.
+    # In a routine, the variable may belong to a caller, if it is declared anywhere (or may be, further
+    # in a program resolved one part at a time).
+    if not scope.in_routine or (self.tok not in resolution.declared and not resolution.partial):
+        resolution.error(self.lineno, f"Variable '{self.tok}' is not defined.")
+
+
+@addToClass(AST.AssignNode)
+def resolve(self, resolution, scope):
+    # The variable is declared in the innermost frame if it does not exist yet
+    target = self.children[0]
+    target.value = UNSET
+    target.depth = 0
+    target.slot = scope.layouts[-1][target.tok]
+
+    self.children[1].resolve(resolution, scope)
+
+
+def resolve_built_in(node, resolution, scope, message):
+    """
+    Links a call to a built-in to its method and checks its number of arguments
+    """
+    function = resolution.built_ins[node.action]
+    node.method = function.method
+
+    if function.arity != -1 and function.arity != len(node.children):
+        resolution.error(node.lineno, message)
+
+    for c in node.children:
+        c.resolve(resolution, scope)
+
+
+@addToClass(AST.FunctionNode)
+def resolve(self, resolution, scope):
+    resolve_built_in(self, resolution, scope, f"Bad number of arguments in '{self.action}' call.")
+
+
+@addToClass(AST.InitNode)
+def resolve(self, resolution, scope):
+    resolve_built_in(self, resolution, scope, f"Bad number of arguments in {self.action} call.")
+
+
+def lookup(frames, name, lineno):
+    """
+    Reads a variable by scanning the frames by name, from the innermost one
+    """
+    for frame in reversed(frames):
+        slot = frame[0].get(name)
+        if slot is not None and frame[slot] is not UNSET:
+            return frame[slot]
+
+    raise DesSineError("Semantic error", lineno, f"Variable '{name}' is not defined.")
+
+
+def assign(frames, name, slot, value):
+    """
+    Assigns a variable which is not set in the innermost frame: an existing variable is updated
+    in its own frame, otherwise it is declared at the given slot of the innermost frame
+    """
+    for frame in reversed(frames):
+        existing = frame[0].get(name)
+        if existing is not None and frame[existing] is not UNSET:
+            frame[existing] = value
+            return
+
+    frames[-1][slot] = value
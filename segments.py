@@ -0,0 +1,347 @@
+from array import array
+
+###########################################
+# DesSine segment buffer
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# Number of segments stored in each chunk of the buffer
+chunk_size = 1 << 16
+
+
+class SegmentChunk:
+    """
+    Fixed capacity struct of arrays holding up to chunk_size segments.
+    Colors and widths are stored as indices into the palettes of the buffer.
+    """
+    __slots__ = ("x0", "y0", "x1", "y1", "color", "width")
+
+    def __init__(self):
+        self.x0 = array("d")
+        self.y0 = array("d")
+        self.x1 = array("d")
+        self.y1 = array("d")
+        self.color = array("I")
+        self.width = array("I")
+
+    def __len__(self):
+        return len(self.x0)
+
+
+class SegmentBuffer:
+    """
+    Record of every segment drawn by a program, growing one chunk at a time.
+    Each segment costs 4 doubles and 2 palette indices, that is 40 bytes.
+
+    All the backends (canvas, drawing.js, PNG) read the drawing from here.
+    Backends consuming the drawing while it is produced register a listener, which is
+    called with the (start, stop) range of new segments every batch_size segments.
+    If the buffer does not retain the segments, they are dropped once the listeners have
+    seen them, so that its memory stays bounded whatever the size of the drawing.
+
+    Filters (such as Deduplicator) are called with each segment before it is recorded,
+    and the segment is dropped if any of them returns False. A filter may also replace a
+    segment (see Culler): it drops it, and appends other ones through the filters after it.
+    """
+
+    def __init__(self, retain=True):
+        # Palettes of the colors and line widths used, as given to setColor and setLineWidth
+        self.colors = []
+        self.widths = []
+        self.color_indices = {}
+        self.width_indices = {}
+        self.chunks = [SegmentChunk()]
+        self.last_style = None
+        self.count = 0
+        self.retain = retain
+        # Index of the first segment still stored
+        self.offset = 0
+
+        self.filters = []
+        self.listeners = []
+        self.batch_size = None
+        self.flushed = 0
+        self.next_flush = None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """
+        Iterates over the segments as (x0, y0, x1, y1, color, width) tuples
+        """
+        return self.range(0, self.count)
+
+    def range(self, start, stop):
+        """
+        Iterates over the segments from index start to stop (excluded)
+        """
+        colors = self.colors
+        widths = self.widths
+        start -= self.offset
+        stop -= self.offset
+        while start < stop:
+            chunk = self.chunks[start // chunk_size]
+            begin = start % chunk_size
+            end = min(chunk_size, begin + stop - start)
+            for x0, y0, x1, y1, c, w in zip(chunk.x0[begin:end], chunk.y0[begin:end], chunk.x1[begin:end],
+                                            chunk.y1[begin:end], chunk.color[begin:end], chunk.width[begin:end]):
+                yield x0, y0, x1, y1, colors[c], widths[w]
+            start += end - begin
+
+    def listen(self, listener, batch_size):
+        """
+        Registers a listener called with each new (start, stop) range of segments.
+        Segments are handed over by batches of batch_size, the last one when flush is called.
+        """
+        self.listeners.append(listener)
+        self.batch_size = batch_size if self.batch_size is None else min(self.batch_size, batch_size)
+        self.next_flush = self.flushed + self.batch_size
+
+    def flush(self):
+        """
+        Hands the segments recorded since the last flush over to the listeners
+        """
+        if self.count > self.flushed:
+            for listener in self.listeners:
+                listener(self.flushed, self.count)
+        self.flushed = self.count
+
+        if not self.retain:
+            self.chunks = [SegmentChunk()]
+            self.offset = self.count
+        if self.batch_size is not None:
+            self.next_flush = self.count + self.batch_size
+
+    def truncate(self, count):
+        """
+        Drops the segments from index count on, which must still be stored.
+        The listeners are handed the next segments from the first one they have not seen.
+        """
+        if count < self.offset:
+            raise ValueError(f"Segments before {self.offset} are not stored anymore")
+
+        kept = count - self.offset
+        self.chunks = self.chunks[:kept // chunk_size + 1]
+        if len(self.chunks) > kept // chunk_size:
+            chunk = self.chunks[-1]
+            for values in (chunk.x0, chunk.y0, chunk.x1, chunk.y1, chunk.color, chunk.width):
+                del values[kept % chunk_size:]
+
+        self.count = count
+        self.flushed = min(self.flushed, count)
+        if self.batch_size is not None:
+            self.next_flush = self.count + self.batch_size
+
+    def style(self, color, width):
+        """
+        Returns the palette indices of the given color and width, adding them if needed
+        """
+        if self.last_style is not None and self.last_style[0] == color and self.last_style[1] == width:
+            return self.last_style[2]
+
+        if color not in self.color_indices:
+            self.color_indices[color] = len(self.colors)
+            self.colors.append(color)
+        if width not in self.width_indices:
+            self.width_indices[width] = len(self.widths)
+            self.widths.append(width)
+
+        indices = (self.color_indices[color], self.width_indices[width])
+        self.last_style = (color, width, indices)
+        return indices
+
+    def append(self, x0, y0, x1, y1, color, width, first_filter=0):
+        """
+        Records a segment from (x0, y0) to (x1, y1), if the filters from index first_filter on keep it
+        """
+        if self.filters:
+            for segment_filter in self.filters[first_filter:] if first_filter else self.filters:
+                if not segment_filter(x0, y0, x1, y1, color, width):
+                    return
+
+        chunk = self.chunks[-1]
+        if len(chunk.x0) == chunk_size:
+            chunk = SegmentChunk()
+            self.chunks.append(chunk)
+
+        c, w = self.style(color, width)
+        chunk.x0.append(x0)
+        chunk.y0.append(y0)
+        chunk.x1.append(x1)
+        chunk.y1.append(y1)
+        chunk.color.append(c)
+        chunk.width.append(w)
+
+        self.count += 1
+        if self.count == self.next_flush:
+            self.flush()
+
+
+class Deduplicator:
+    """
+    Segment filter dropping the segments already drawn, in either direction, with the same style.
+
+    Endpoints are snapped to a grid of tolerance pixels and hashed, so that segments differing
+    only by rounding errors are found too. Only the current run of segments sharing a style is
+    remembered: a retraced segment is never dropped if something else may have been drawn over
+    it meanwhile, so the drawing looks exactly the same.
+    """
+
+    def __init__(self, tolerance=1e-3, capacity=1 << 22):
+        """
+        Args:
+            tolerance: size of the grid cells endpoints are snapped to, in pixels
+            capacity: maximum number of segments remembered, to bound memory on huge runs
+        """
+        self.scale = 1 / tolerance
+        self.capacity = capacity
+        self.seen = set()
+        self.style = None
+        self.removed = 0
+
+    def __call__(self, x0, y0, x1, y1, color, width):
+        if self.style != (color, width) or len(self.seen) >= self.capacity:
+            self.style = (color, width)
+            self.seen.clear()
+
+        start = (round(x0 * self.scale), round(y0 * self.scale))
+        end = (round(x1 * self.scale), round(y1 * self.scale))
+        key = (start, end) if start <= end else (end, start)
+
+        if key in self.seen:
+            self.removed += 1
+            return False
+
+        self.seen.add(key)
+        return True
+
+
+# Outcodes of the points, for the clipping of the Culler
+inside, left, right, top, bottom = 0, 1, 2, 4, 8
+
+
+class Culler:
+    """
+    Segment filter dropping what cannot be seen: the segments out of the canvas are dropped and
+    the ones crossing its border are clipped (Cohen-Sutherland), and runs of segments shorter than
+    a pixel are merged.
+
+    A path of short segments (each starting where the previous one ended, with the same style)
+    is drawn as chords: a chord ends at the first point of the path at least tolerance pixels
+    away from its start, so the path never strays further than tolerance from its chords.
+    The last chord of a path is only drawn once the path ends, flush draws it at the end of
+    the run.
+    """
+
+    def __init__(self, segments, width, height, tolerance=0.25):
+        """
+        Args:
+            segments: SegmentBuffer the filter is added to
+            width, height: size of the canvas
+            tolerance: length in pixels under which segments are merged, 0 to only clip them
+        """
+        self.segments = segments
+        self.width = width
+        self.height = height
+        self.tolerance = tolerance
+        # Chord being drawn: start, end and style
+        self.pending = None
+        self.culled = 0
+        self.clipped = 0
+        self.merged = 0
+
+    def emit(self, x0, y0, x1, y1, color, width):
+        """
+        Appends a segment through the filters after this one
+        """
+        self.segments.append(x0, y0, x1, y1, color, width, self.segments.filters.index(self) + 1)
+
+    def flush(self):
+        """
+        Draws the chord being drawn, if any
+        """
+        if self.pending is not None:
+            pending = self.pending
+            self.pending = None
+            self.emit(*pending)
+
+    def outcode(self, x, y, margin):
+        code = inside
+        if x < -margin:
+            code |= left
+        elif x > self.width + margin:
+            code |= right
+        if y < -margin:
+            code |= top
+        elif y > self.height + margin:
+            code |= bottom
+        return code
+
+    def clip(self, x0, y0, x1, y1, margin):
+        """
+        Returns the part of the segment within the canvas (enlarged by margin), None if there is none
+        """
+        xmin, ymin = -margin, -margin
+        xmax, ymax = self.width + margin, self.height + margin
+        code0 = self.outcode(x0, y0, margin)
+        code1 = self.outcode(x1, y1, margin)
+
+        while True:
+            if not code0 | code1:
+                return x0, y0, x1, y1
+            if code0 & code1:
+                return None
+
+            # Moves the outer point onto the border it is beyond
+            code = code0 or code1
+            if code & bottom:
+                x, y = x0 + (x1 - x0) * (ymax - y0) / (y1 - y0), ymax
+            elif code & top:
+                x, y = x0 + (x1 - x0) * (ymin - y0) / (y1 - y0), ymin
+            elif code & right:
+                x, y = xmax, y0 + (y1 - y0) * (xmax - x0) / (x1 - x0)
+            else:
+                x, y = xmin, y0 + (y1 - y0) * (xmin - x0) / (x1 - x0)
+
+            if code == code0:
+                x0, y0 = x, y
+                code0 = self.outcode(x0, y0, margin)
+            else:
+                x1, y1 = x, y
+                code1 = self.outcode(x1, y1, margin)
+
+    def __call__(self, x0, y0, x1, y1, color, width):
+        # The caps of thick lines may show even if the line itself is just out of the canvas
+        margin = width + 1
+        if (x0 < -margin or y0 < -margin or x0 > self.width + margin or y0 > self.height + margin
+                or x1 < -margin or y1 < -margin or x1 > self.width + margin or y1 > self.height + margin):
+            clipped = self.clip(x0, y0, x1, y1, margin)
+            self.flush()
+            if clipped is None:
+                self.culled += 1
+            else:
+                self.clipped += 1
+                self.emit(*clipped, color, width)
+            return False
+
+        tolerance = self.tolerance
+        pending = self.pending
+        if pending is not None:
+            if pending[2] == x0 and pending[3] == y0 and pending[4] == color and pending[5] == width:
+                # The path goes on
+                self.merged += 1
+                if (x1 - pending[0]) ** 2 + (y1 - pending[1]) ** 2 >= tolerance * tolerance:
+                    self.pending = None
+                    self.emit(pending[0], pending[1], x1, y1, color, width)
+                else:
+                    pending[2], pending[3] = x1, y1
+                return False
+            self.flush()
+
+        if (x1 - x0) ** 2 + (y1 - y0) ** 2 >= tolerance * tolerance:
+            return True
+
+        self.pending = [x0, y0, x1, y1, color, width]
+        return False
@@ -0,0 +1,402 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit, parse_qs
+import asyncio, json, os, shutil, signal, sys, tempfile, time
+
+import logger
+from limits import default_depth
+
+###########################################
+# DesSine render server
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# The server renders the programs posted to it over HTTP, on a TCP port or a Unix socket:
+#
+#   curl --data-binary @hello.ds 'localhost:8642/render?format=svg&max_time=2' > hello.svg
+#
+# Programs are run by a pool of worker processes started (and warmed up: every module imported,
+# the tables of the parser loaded) once and for all, so a request costs neither the startup of
+# python nor the loading of PLY. Each worker writes the drawing to a temporary file, which the
+# server then streams back in chunks, as fast as the client reads them.
+#
+# At most --queue requests wait for a worker, the next ones are turned down with 503 until the
+# workers catch up. Every run has limits (see limits.py): the ones asked for by the request,
+# within the ones of the server. The canvas set by the init block is checked by the server before
+# the program is sent to a worker, as a worker running out of memory breaks the whole pool.
+
+# Content type of the drawings, by format (js is the compact drawing.js, see jsexport.py)
+formats = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "js": "application/javascript",
+}
+
+# Limits a request may ask for, with their type
+limit_options = {
+    "max_statements": int,
+    "max_segments": int,
+    "max_depth": int,
+    "max_time": float,
+}
+
+# Size of the chunks the drawings are sent by
+chunk_size = 1 << 16
+
+reasons = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+# What a worker tells about a run: the number of segments drawn, the durations of its phases,
+# and the message of the error or the limit which stopped it, if any
+Outcome = namedtuple("Outcome", ["segments", "phases", "error", "limit"])
+
+
+class HttpError(Exception):
+    """
+    Turns a request down with the given status
+    """
+
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+def warm_up():
+    """
+    Initializer of the workers: imports everything a run needs, so that the first request
+    served by a worker is as fast as the next ones
+    """
+    # What the programs log would mix with the server's log, every request is logged by the server
+    sys.stdout = open(os.devnull, "w")
+
+    import interpreter, compiler, evaluator, dessine_parser, rasterizer, svg, jsexport
+
+
+def ready():
+    return os.getpid()
+
+
+def canvas_area(source):
+    """
+    Returns the area in pixels of the canvas set by the init block of a program, or None if the
+    init block cannot be run, in which case the worker reports the error
+    """
+    import interpreter
+    from dessine_parser import parse
+    from errors import DesSineError
+    from stream import parts
+
+    runner = interpreter.Interpreter()
+    context = interpreter.RenderContext()
+    try:
+        # The init block, along with the first statement, as a program needs a body
+        _, text = next(parts(source.splitlines(keepends=True), 1), (1, ""))
+        runner.prepare(parse(text), context)
+    except (DesSineError, RecursionError):
+        return None
+    return context.state["width"] * context.state["height"]
+
+
+def render(source, output_format, path, engine, limits):
+    """
+    Runs a program and writes its drawing to path, in a worker process
+    """
+    import interpreter
+    from errors import DesSineError
+
+    runner = interpreter.Interpreter(engine, **limits)
+    context = interpreter.RenderContext()
+    try:
+        runner.prepare(runner.parse(source, context), context)
+
+        if output_format == "png":
+            context.execute()
+            interpreter.render_png(context, path)
+        elif output_format == "svg":
+            from svg import SvgWriter
+            interpreter.stream_drawing(context, path, SvgWriter, context.execute)
+        else:
+            from jsexport import BinaryJsWriter
+            interpreter.stream_drawing(context, path, BinaryJsWriter, context.execute)
+    except DesSineError as e:
+        # Exceptions go back to the server pickled, which errors with several arguments do not survive
+        errors = getattr(e, "errors", [e])
+        return Outcome(len(context.segments), context.phases, "\n".join(map(str, errors)), None)
+
+    limit = str(context.exceeded) if context.exceeded is not None else None
+    return Outcome(len(context.segments), context.phases, None, limit)
+
+
+class Server:
+    """
+    Serves the requests, running the programs in a pool of worker processes
+    """
+
+    def __init__(self, workers, queue, engine, limits, max_size, max_area):
+        """
+        Args:
+            workers: number of worker processes
+            queue: number of requests which may wait for a worker
+            engine: execution engine of the runs (see interpreter.py)
+            limits: limits of every run, as keyword arguments of Interpreter
+            max_size: maximum size of a program, in bytes
+            max_area: maximum area of the canvas of a program, in pixels
+        """
+        self.workers = workers
+        self.queue = queue
+        self.engine = engine
+        self.limits = limits
+        self.max_size = max_size
+        self.max_area = max_area
+        self.pool = ProcessPoolExecutor(workers, initializer=warm_up)
+        self.slots = asyncio.Semaphore(workers)
+        self.directory = tempfile.mkdtemp(prefix="dessine-")
+        # Requests running or waiting for a worker
+        self.pending = 0
+        self.served = 0
+        self.next_id = 0
+
+    async def start(self):
+        """
+        Starts every worker, and waits for them to be warmed up
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, ready) for _ in range(self.workers)))
+
+    def restart(self):
+        """
+        Replaces a broken pool with a new one
+        """
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=warm_up)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def request_limits(self, query):
+        """
+        Returns the limits of a run: the ones asked for in the query, within the server's
+        """
+        limits = dict(self.limits)
+        for name, kind in limit_options.items():
+            if name not in query:
+                continue
+            try:
+                value = kind(query[name][-1])
+            except ValueError:
+                raise HttpError(400, f"{name} must be a number.")
+            if value <= 0:
+                raise HttpError(400, f"{name} must be positive.")
+            limits[name] = value if limits[name] is None else min(value, limits[name])
+        return limits
+
+    async def handle(self, reader, writer):
+        """
+        Serves a connection, with a single request
+        """
+        try:
+            try:
+                await self.serve(reader, writer)
+            except HttpError as e:
+                await self.respond(writer, e.status, "text/plain", str(e).encode() + b"\n", e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            # The client went away, or sent garbage
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, reader, writer):
+        method, target, headers = await self.read_head(reader)
+        url = urlsplit(target)
+
+        if url.path == "/status":
+            status = {"workers": self.workers, "pending": self.pending, "queue": self.queue, "served": self.served}
+            await self.respond(writer, 200, "application/json", json.dumps(status).encode())
+            return
+        if url.path != "/render":
+            raise HttpError(404, f"No such resource: {url.path}")
+        if method != "POST":
+            raise HttpError(405, "Programs are rendered with POST /render.", [("Allow", "POST")])
+
+        query = parse_qs(url.query)
+        output_format = query.get("format", ["png"])[-1]
+        if output_format not in formats:
+            raise HttpError(400, f"Unknown format {output_format}, expected one of {', '.join(formats)}.")
+        limits = self.request_limits(query)
+
+        if "content-length" not in headers:
+            raise HttpError(411, "The program has to be sent with its Content-Length.")
+        size = headers["content-length"]
+        if not size.isdigit():
+            raise HttpError(400, "Malformed Content-Length.")
+        size = int(size)
+        if size > self.max_size:
+            raise HttpError(413, f"Programs are limited to {self.max_size} bytes.")
+        source = await reader.readexactly(size)
+        try:
+            source = source.decode()
+        except UnicodeDecodeError:
+            raise HttpError(400, "Programs must be encoded in UTF-8.")
+
+        # Parsed in a thread, not to hold up the other requests
+        area = await asyncio.to_thread(canvas_area, source)
+        if area is not None and area > self.max_area:
+            raise HttpError(422, f"Canvases are limited to {self.max_area} pixels, this one has {area:g}.")
+
+        # Backpressure: once the queue is full, the client has to come back later
+        if self.pending >= self.workers + self.queue:
+            raise HttpError(503, "Too many programs waiting to be rendered.", [("Retry-After", "1")])
+
+        self.next_id += 1
+        request = self.next_id
+        path = os.path.join(self.directory, f"{request}.{output_format}")
+        self.pending += 1
+        try:
+            async with self.slots:
+                start = time.perf_counter()
+                outcome = await asyncio.get_running_loop().run_in_executor(
+                    self.pool, render, source, output_format, path, self.engine, limits)
+                elapsed = time.perf_counter() - start
+        except Exception as e:
+            logger.error("Server error", "-", f"Request {request} failed: {e!r}")
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. out of memory), which breaks the whole pool
+                self.restart()
+            raise HttpError(500, "The program could not be rendered.")
+        finally:
+            self.pending -= 1
+
+        try:
+            if outcome.error is not None:
+                logger.warning("Server", f"Request {request}: {outcome.error}")
+                raise HttpError(422, outcome.error)
+
+            headers = [("X-DesSine-Segments", str(outcome.segments))]
+            headers += [(f"X-DesSine-{phase.capitalize()}", f"{t:.6f}") for phase, t in outcome.phases.items()]
+            if outcome.limit is not None:
+                headers.append(("X-DesSine-Limit", outcome.limit))
+
+            logger.info("Server", f"Request {request}: rendered {outcome.segments} lines to {output_format} in {elapsed:.3f}s")
+            await self.stream(writer, path, formats[output_format], headers)
+            self.served += 1
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def read_head(self, reader):
+        """
+        Reads the request line and the headers of a request
+        """
+        line = (await reader.readuntil(b"\r\n")).decode("latin-1").split()
+        if len(line) != 3:
+            raise HttpError(400, "Malformed request line.")
+        method, target, _ = line
+
+        headers = {}
+        while True:
+            line = (await reader.readuntil(b"\r\n")).decode("latin-1").strip()
+            if not line:
+                return method, target, headers
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    def head(self, status, content_type, headers):
+        lines = [f"HTTP/1.1 {status} {reasons[status]}", f"Content-Type: {content_type}", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        return ("\r\n".join(lines) + "\r\n").encode("latin-1")
+
+    async def respond(self, writer, status, content_type, body, headers=()):
+        writer.write(self.head(status, content_type, list(headers) + [("Content-Length", len(body))]) + b"\r\n")
+        writer.write(body)
+        await writer.drain()
+
+    async def stream(self, writer, path, content_type, headers):
+        """
+        Sends a drawing in chunks, waiting for the client to read each of them
+        """
+        writer.write(self.head(200, content_type, headers + [("Transfer-Encoding", "chunked")]) + b"\r\n")
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+def parse_arguments(argv):
+    """
+    Parses the command line arguments of the server
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Renders the DesSine programs posted to POST /render")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8642, help="TCP port to listen on")
+    parser.add_argument("--socket", metavar="PATH", help="listen on a Unix socket instead of a TCP port")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--queue", type=int, default=16,
+                        help="number of requests which may wait for a worker before the next ones are turned down")
+    parser.add_argument("--engine", choices=["tree", "closure", "stack"], default="closure",
+                        help="execution engine of the programs (see interpreter.py)")
+    parser.add_argument("--max-size", type=int, default=1 << 20, help="maximum size of a program, in bytes")
+    parser.add_argument("--max-area", type=int, default=1 << 25,
+                        help="maximum area of the canvas of a program (width × height), in pixels")
+    parser.add_argument("--max-statements", type=int, metavar="N", help="limit of every run, see interpreter.py")
+    parser.add_argument("--max-segments", type=int, metavar="N", help="limit of every run, see interpreter.py")
+    parser.add_argument("--max-depth", type=int, default=default_depth, metavar="N",
+                        help="limit of every run, requests may only ask for lower limits")
+    parser.add_argument("--max-time", type=float, default=10, metavar="SECONDS",
+                        help="limit of every run, requests may only ask for lower limits")
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    limits = {name: getattr(args, name) for name in limit_options}
+    server = Server(args.workers, args.queue, args.engine, limits, args.max_size, args.max_area)
+    try:
+        await server.start()
+        if args.socket:
+            listener = await asyncio.start_unix_server(server.handle, args.socket)
+            address = args.socket
+        else:
+            listener = await asyncio.start_server(server.handle, args.host, args.port)
+            address = f"http://{args.host}:{args.port}"
+
+        # Stops serving on SIGINT or SIGTERM, removing the temporary files and the socket
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        logger.info("Server", f"{args.workers} workers ready, listening on {address}")
+        async with listener:
+            await stopped.wait()
+        logger.info("Server", f"Stopped after serving {server.served} requests.")
+    finally:
+        server.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def main(argv=None):
+    asyncio.run(serve(parse_arguments(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import AST
+from time import perf_counter
+
+import lex
+from dessine_parser import parse
+from errors import DesSineError
+from limits import LimitExceeded, stack_exhausted
+from resolver import Resolution, resolve_statements
+
+###########################################
+# DesSine streaming
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# In stream mode, a program is read, parsed and run a few top-level statements at a time, so that
+# generated programs of millions of lines start drawing at once and only the tree of the statements
+# being run is in memory.
+#
+# The lines of the file are split into parts of at most part_size top-level statements, by counting
+# the brackets and parentheses of their tokens. Each part of the body is parsed as a program of its
+# own, after an init instruction which is then dropped, and resolved in the frame of the program,
+# which grows with the variables of each part (see resolve_statements in resolver.py). The calls
+# are not linked to their routines, they are looked up when run: a routine has to be defined before
+# the statements calling it run, as it would have to be anyway.
+
+# Number of top-level statements parsed and run at once
+part_size = 256
+
+# Put before each part of the body, which is not a program without an init block
+prefix = "#width(0)\n"
+
+# Change of the depth of the brackets and parentheses by token
+nesting = {
+    "BRACKET_OPEN": 1,
+    "BRACKET_CLOSE": -1,
+    "PARENTHESIS_OPEN": 1,
+    "PARENTHESIS_CLOSE": -1,
+}
+
+
+def parts(lines, size=part_size):
+    """
+    Splits the lines of a program into parts of at most size top-level statements, the first one
+    holding the init block too. Yields the number of the first line of each part, and its text.
+    """
+    lexer = lex.lexer.clone()
+    start = None
+    text = []
+    depth = 0
+    statements = 0
+    # Whether a statement is being read, and whether the first part was yielded
+    reading = False
+    started = False
+
+    for lineno, line in enumerate(lines, 1):
+        lexer.lineno = lineno
+        lexer.input(line)
+        tokens = [t.type for t in lexer if t.type != "newline"]
+
+        if start is None:
+            # Lines with nothing to parse between two parts are dropped
+            if not tokens:
+                continue
+            start = lineno
+        text.append(line)
+
+        if depth == 0 and tokens and not reading:
+            if tokens[0] != "INIT_PREFIX":
+                reading = True
+            elif started:
+                # In the first part, the parser reports an init instruction out of the init block
+                raise DesSineError("Syntax error", lineno, "Unexpected token '#'")
+
+        depth += sum(nesting.get(t, 0) for t in tokens)
+        if reading and depth <= 0:
+            reading = False
+            statements += 1
+            # Too many closing brackets end the part, so that its parser reports them
+            if statements == size or depth < 0:
+                yield start, "".join(text)
+                started = True
+                start = None
+                text = []
+                depth = 0
+                statements = 0
+
+    if text:
+        yield start, "".join(text)
+
+
+class Stream:
+    """
+    A program run as it is read from its file
+    """
+
+    def __init__(self, path, interpreter, constants, size=part_size):
+        """
+        Args:
+            path: file of the program
+            interpreter: Interpreter running the program (see interpreter.py)
+            constants: constants of the programs, by name
+            size: maximum number of top-level statements parsed and run at once
+        """
+        self.path = path
+        self.interpreter = interpreter
+        self.constants = constants
+        self.size = size
+
+        self.file = None
+        self.parts = None
+        self.resolution = None
+        # Statements of the first part, parsed along with the init block
+        self.first = None
+
+    def parse(self, lineno, text, context, part=True):
+        """
+        Returns the optimized tree of a part of the program starting at the given line, which
+        has no init block if part is True
+        """
+        start = perf_counter()
+        if part:
+            tree = parse(prefix + text, lineno - 1)
+        else:
+            tree = parse(text, lineno)
+        context.phases["parse"] = context.phases.get("parse", 0) + perf_counter() - start
+
+        if self.interpreter.optimize:
+            self.interpreter.optimize_tree(tree, context)
+        return tree
+
+    def prepare(self, context):
+        """
+        Reads the program up to the end of its first part, and runs its init block in the given
+        context, which is then ready to execute the body of the program (see Interpreter.prepare)
+        """
+        self.file = open(self.path)
+        self.parts = parts(self.file, self.size)
+        try:
+            lineno, text = next(self.parts, (1, ""))
+            tree = self.parse(lineno, text, context, part=False)
+        except DesSineError:
+            self.file.close()
+            raise
+        init, body = tree.children
+
+        # The program's tree only keeps the init block, the statements are dropped once run
+        head = AST.ProgramNode(tree.lineno, [init, AST.BodyNode(body.lineno, [])])
+        self.interpreter.prepare(head, context, optimized=True)
+        self.resolution = Resolution(head, context.built_ins, self.constants, partial=True)
+        self.first = body.children
+
+    def runner(self, context):
+        """
+        Returns a function running top-level statements with the engine of the run
+        """
+        if context.engine == "closure":
+            import compiler
+            env = context.environment()
+            routines = compiler.Routines()
+            return lambda statements: compiler.compile_statements(statements, env, routines)()
+
+        if context.engine == "stack":
+            import evaluator
+            flattener = evaluator.Flattener(context.environment())
+
+            def run(statements):
+                code = []
+                for statement in statements:
+                    evaluator.flatten_statement(statement, code, flattener)
+                code.append((evaluator.RETURN, False))
+                evaluator.run(code, flattener)
+            return run
+
+        def run(statements):
+            for statement in statements:
+                statement.execute(context)
+        return run
+
+    def execute(self, context):
+        """
+        Runs the body of the program, part by part. Like RenderContext.execute, keeps the
+        LimitExceeded which stopped it in the context's exceeded.
+        """
+        start = perf_counter()
+        parsing = context.phases.get("parse", 0)
+        statements, self.first = self.first, None
+        try:
+            run = self.runner(context)
+            if context.limits is not None:
+                context.limits.start()
+
+            while statements is not None:
+                resolve_statements(statements, context.frames[0], self.resolution)
+                run(statements)
+
+                part = next(self.parts, None)
+                statements = None if part is None else self.parse(*part, context).children[1].children
+        except LimitExceeded as e:
+            context.exceeded = e
+        except RecursionError:
+            context.exceeded = stack_exhausted()
+        finally:
+            self.file.close()
+            if context.culler is not None:
+                context.culler.flush()
+            # Parsing the parts is measured on its own
+            context.phases["execute"] = perf_counter() - start - (context.phases.get("parse", 0) - parsing)
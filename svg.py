@@ -0,0 +1,70 @@
+###########################################
+# DesSine SVG exporter
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# Maximum number of segments in a single <path>, so that viewers do not choke on huge attributes
+path_length = 10000
+
+
+class SvgWriter:
+    """
+    Writes segments to an SVG file as they are produced, without keeping them in memory.
+    Consecutive segments sharing the same color and line width are written in the same <path>,
+    with round caps and joins so that wide lines are not disjointed.
+    """
+
+    def __init__(self, file, width, height, background, format_color):
+        """
+        Args:
+            file: text file the SVG document is written to
+            background: color of the background, formatted by format_color
+            format_color: function converting a DesSine color into an SVG color
+        """
+        self.file = file
+        self.format_color = format_color
+        self.style = None
+        self.last = None
+        self.length = 0
+
+        file.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                   f'viewBox="0 0 {width} {height}">\n')
+        file.write(f'<rect width="100%" height="100%" fill="{format_color(background)}"/>\n')
+
+    def write(self, segments):
+        """
+        Writes the given (x0, y0, x1, y1, color, width) segments
+        """
+        write = self.file.write
+        for x0, y0, x1, y1, color, lw in segments:
+            if self.style != (color, lw) or self.length == path_length:
+                self.close_path()
+                self.style = (color, lw)
+                write(f'<path fill="none" stroke="{self.format_color(color)}" stroke-width="{lw}" '
+                      f'stroke-linecap="round" stroke-linejoin="round" d="')
+
+            # A segment starting where the previous one ended continues the same line
+            if self.last != (x0, y0):
+                write(f"M{x0:.6g} {y0:.6g}")
+            write(f"L{x1:.6g} {y1:.6g}")
+
+            self.last = (x1, y1)
+            self.length += 1
+
+    def close_path(self):
+        """
+        Ends the <path> being written, if any
+        """
+        if self.style is not None:
+            self.file.write('"/>\n')
+        self.style = None
+        self.last = None
+        self.length = 0
+
+    def close(self):
+        """
+        Ends the SVG document
+        """
+        self.close_path()
+        self.file.write("</svg>\n")
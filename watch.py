@@ -0,0 +1,376 @@
+import AST
+from bisect import bisect_right
+from collections import namedtuple
+from functools import partial
+import os, threading
+
+import logger
+from errors import DesSineError
+from limits import Limits, LimitExceeded
+from resolver import new_frame, walk
+
+###########################################
+# DesSine live reload
+# Made by Pierre Bürki and Loïck Jeanneret
+# Last updated on 11.01.20
+###########################################
+
+# In watch mode, the window stays open and the program is run again each time its file changes.
+# The body runs one top-level statement at a time, and the state of the run is saved before each
+# of them: the turtle, the program's frame, the routines defined and the number of segments drawn.
+#
+# When the file changes, its new top-level statements are compared with the previous ones, as
+# optimized but not resolved, without line numbers. The run starts again from the first one which
+# changed, or which calls (even indirectly) a routine whose definition changed, in the state saved
+# before it. Only the canvas items of the statements run again are replaced: each item is tagged
+# with the statement which drew it. A change of the init block runs the whole program again.
+
+# Seconds between two checks of the file
+interval = 0.5
+
+# Attributes of the nodes which are not part of the program they hold
+untracked = {"lineno", "children"}
+
+# State of a run before a top-level statement
+Checkpoint = namedtuple("Checkpoint", ["state", "frame", "defined", "segments"])
+
+
+def signature(node):
+    """
+    Returns the structure of a node, as parsed (and optimized), which does not depend on where it is in the file
+    """
+    fields = tuple(sorted((name, signature(value) if isinstance(value, AST.Node) else value)
+                          for name, value in node.fields().items() if name not in untracked))
+    return type(node).__name__, fields, tuple(signature(c) for c in node.children)
+
+
+def definitions(node):
+    return [n for n in walk(node) if isinstance(n, AST.RoutineDefinitionNode)]
+
+
+def calls(node):
+    """
+    Names of the routines called by the node
+    """
+    return {n.name for n in walk(node) if isinstance(n, AST.RoutineCallNode)}
+
+
+class Version:
+    """
+    A version of the program: its tree, and what is compared with the next version
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.statements = tree.children[1].children
+        self.init = signature(tree.children[0])
+        self.signatures = [signature(c) for c in self.statements]
+
+        self.routines = {}
+        self.callees = {}
+        for definition in definitions(tree):
+            self.routines.setdefault(definition.name, []).append(signature(definition))
+            self.callees.setdefault(definition.name, set()).update(calls(definition.block))
+
+    def changed_routines(self, previous):
+        """
+        Names of the routines whose definitions changed since the previous version, or which call one
+        """
+        changed = {name for name in self.routines.keys() | previous.routines.keys()
+                   if self.routines.get(name) != previous.routines.get(name)}
+
+        # Callers of changed routines change too
+        growing = True
+        while growing:
+            callers = {name for name, callees in self.callees.items() if callees & changed}
+            growing = not callers <= changed
+            changed |= callers
+        return changed
+
+    def linked(self, statement, previous):
+        """
+        Tells whether a statement is the only definition of its routine, in both versions. The
+        resolver links the calls to such routines, defining them again is then not needed: a
+        change of the routine only runs again the statements calling it.
+        """
+        return (isinstance(statement, AST.RoutineDefinitionNode)
+                and len(self.routines[statement.name]) == len(previous.routines.get(statement.name, ())) == 1
+                and len(definitions(statement)) == 1)
+
+    def first_change(self, previous):
+        """
+        Index of the first top-level statement to run again after the previous version
+        """
+        changed = self.changed_routines(previous)
+        for i, (old, new) in enumerate(zip(previous.signatures, self.signatures)):
+            if calls(self.statements[i]) & changed:
+                return i
+            if old != new and not self.linked(self.statements[i], previous):
+                return i
+        if len(previous.signatures) == len(self.signatures):
+            return None
+        return min(len(previous.signatures), len(self.signatures))
+
+
+class Watcher:
+    """
+    Runs a program in a window, again each time its file changes
+    """
+
+    def __init__(self, path, interpreter, new_context, open_window, draw_on_canvas, batch_size=1000, draw_chunk=5000):
+        """
+        Args:
+            path: file of the program
+            interpreter: Interpreter running the program (see interpreter.py)
+            new_context: returns a new RenderContext
+            open_window: creates the window of a context (or resizes the given canvas), and returns its canvas
+            draw_on_canvas: draws a range of segments on the canvas (see interpreter.py)
+            batch_size: number of segments handed at once from the run to the window
+            draw_chunk: maximum number of segments drawn before handling the events of the window
+        """
+        self.path = path
+        self.interpreter = interpreter
+        self.new_context = new_context
+        self.open_window = open_window
+        self.draw_on_canvas = draw_on_canvas
+        self.batch_size = batch_size
+        self.draw_chunk = draw_chunk
+
+        self.context = None
+        self.canvas = None
+        self.version = None
+        self.modified = None
+        self.worker = None
+        # Functions running each top-level statement, and the routines defined so far by name
+        self.statements = []
+        self.defined = {}
+        # Checkpoints of the run, before each statement run so far and after the last one,
+        # and the number of segments drawn before each of them, to tag the canvas items
+        self.checkpoints = []
+        self.counts = []
+        # Segments handed over by the run, and drawn on the canvas
+        self.available = 0
+        self.drawn = 0
+
+    def load(self):
+        """
+        Parses and optimizes the program, and returns its Version, or None if it did not change
+        """
+        modified = os.stat(self.path).st_mtime
+        if modified == self.modified:
+            return None
+        self.modified = modified
+
+        with open(self.path) as f:
+            source = f.read()
+        context = self.new_context()
+        tree = self.interpreter.parse(source, context)
+        if self.interpreter.optimize:
+            self.interpreter.optimize_tree(tree, context)
+        return Version(tree)
+
+    def start(self):
+        """
+        Runs the program, opens the window and watches the file until the window is closed
+        """
+        self.restart(self.load())
+        self.canvas = self.open_window(self.context)
+
+        self.canvas.after(0, self.drain)
+        self.canvas.after(int(interval * 1000), self.poll)
+        self.canvas.master.mainloop()
+        self.stop()
+
+    def restart(self, version):
+        """
+        Runs the whole program again, in a new context
+        """
+        context = self.new_context()
+        self.interpreter.prepare(version.tree, context, optimized=True)
+        self.stop()
+
+        self.context = context
+        self.version = version
+        self.setup()
+        context.segments.listen(self.hand_over, self.batch_size)
+        self.checkpoints = []
+        self.counts = []
+        self.available = self.drawn = 0
+
+        if self.canvas is not None:
+            self.canvas.delete("all")
+            self.open_window(context, self.canvas)
+        self.run_from(0)
+
+    def setup(self):
+        """
+        Compiles each top-level statement of the program with the engine of the run
+        """
+        context = self.context
+        if context.limits is None:
+            # Runs are cancelled through their limits
+            context.limits = Limits()
+        body = context.tree.children[1].children
+
+        if context.engine == "closure":
+            import compiler
+            routines = compiler.Routines()
+            env = context.environment()
+            self.statements = [c.compile(env, routines) for c in body]
+            self.defined = routines.defined
+        elif context.engine == "stack":
+            import evaluator
+            flattener = evaluator.Flattener(context.environment())
+            self.statements = []
+            for c in body:
+                code = []
+                evaluator.flatten_statement(c, code, flattener)
+                code.append((evaluator.RETURN, False))
+                self.statements.append(partial(evaluator.run, code, flattener))
+            self.defined = flattener.routines.defined
+        else:
+            self.statements = [partial(c.execute, context) for c in body]
+            self.defined = context.routines = {}
+
+    def hand_over(self, start, stop):
+        # Called by the run's thread, the window draws up to there
+        self.available = stop
+
+    def checkpoint(self):
+        context = self.context
+        if context.culler is not None:
+            # The segments of a statement are all drawn before the next one
+            context.culler.flush()
+        self.checkpoints.append(Checkpoint(dict(context.state), context.frames[0].copy(), dict(self.defined),
+                                           len(context.segments)))
+        self.counts.append(len(context.segments))
+
+    def run(self, start):
+        """
+        Runs the top-level statements from the given one on, saving the state before each of them
+        """
+        context = self.context
+        context.limits.start()
+        try:
+            for i in range(start, len(self.statements)):
+                self.checkpoint()
+                self.statements[i]()
+            self.checkpoint()
+        except LimitExceeded as e:
+            if e.limit != "cancel":
+                logger.error(e.kind, e.line, f"{e.message}, the drawing stops after {len(context.segments)} lines.")
+        except DesSineError as e:
+            e.log()
+        except RecursionError:
+            logger.error("Runtime error", "-", "Too many nested routine calls, try --engine stack.")
+        finally:
+            context.segments.flush()
+
+    def run_from(self, start):
+        self.worker = threading.Thread(target=self.run, args=(start,), daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        """
+        Cancels the run, and waits for it to stop
+        """
+        if self.worker is not None:
+            self.context.limits.cancel()
+            self.worker.join()
+            self.worker = None
+
+    def poll(self):
+        try:
+            version = self.load()
+            if version is not None:
+                self.reload(version)
+        except DesSineError as e:
+            # The drawing of the last version which ran stays in the window
+            e.log()
+        except OSError as e:
+            logger.warning("Watch", f"Could not read {self.path}: {e}")
+        self.canvas.after(int(interval * 1000), self.poll)
+
+    def reload(self, version):
+        """
+        Runs the new version of the program, from its first change on
+        """
+        if version.init != self.version.init:
+            self.restart(version)
+            logger.info("Watch", "The init block changed, running the whole program again.")
+            return
+
+        first = version.first_change(self.version)
+        if first is None:
+            logger.info("Watch", "Nothing to run again.")
+            self.version = version
+            return
+
+        # Resolving may fail, the previous version keeps running until then
+        self.interpreter.resolve(version.tree, self.context)
+        self.stop()
+
+        # The last checkpoint is the furthest the previous run went
+        first = min(first, len(self.checkpoints) - 1)
+        self.restore(first, version)
+        self.version = version
+        self.run_from(first)
+        logger.info("Watch", f"Running again from line {version.statements[first].lineno}."
+                    if first < len(version.statements) else "Removed the end of the drawing.")
+
+    def restore(self, index, version):
+        """
+        Puts the context back in the state of the given checkpoint, for the new version of the program
+        """
+        context = self.context
+        checkpoint = self.checkpoints[index]
+
+        # Definitions run before the checkpoint are the same in the new version, at the same place
+        previous = [d for c in self.version.statements[:index] for d in definitions(c)]
+        current = [d for c in version.statements[:index] for d in definitions(c)]
+        renamed = dict(zip(map(id, previous), current))
+
+        layout = context.tree.frame[0]
+        frame = new_frame(layout)
+        for name, slot in checkpoint.frame[0].items():
+            if name in layout:
+                frame[layout[name]] = checkpoint.frame[slot]
+
+        context.state.clear()
+        context.state.update(checkpoint.state)
+        context.frames[:] = [frame]
+        context.segments.truncate(checkpoint.segments)
+        if context.culler is not None:
+            context.culler.pending = None
+        if context.deduplicator is not None:
+            # The segments it remembers may have been dropped
+            context.deduplicator.style = None
+        self.interpreter.reset(context)
+        self.setup()
+        self.defined.clear()
+        self.defined.update({name: renamed[id(definition)] for name, definition in checkpoint.defined.items()
+                             if id(definition) in renamed})
+
+        # Items of the statements run again are replaced
+        for i in range(index, len(self.checkpoints)):
+            self.canvas.delete(f"s{i}")
+        del self.checkpoints[index:]
+        del self.counts[index:]
+        self.available = min(self.available, checkpoint.segments)
+        self.drawn = min(self.drawn, checkpoint.segments)
+
+    def drain(self):
+        """
+        Draws at most draw_chunk of the segments handed over, each tagged with the statement which drew it
+        """
+        budget = self.draw_chunk
+        segments = self.context.segments
+        while budget > 0 and self.drawn < self.available:
+            statement = bisect_right(self.counts, self.drawn) - 1
+            end = self.counts[statement + 1] if statement + 1 < len(self.counts) else self.available
+            stop = min(self.available, end, self.drawn + budget)
+            self.draw_on_canvas(self.canvas, segments, self.drawn, stop, (f"s{statement}",))
+            budget -= stop - self.drawn
+            self.drawn = stop
+
+        self.canvas.after(1 if budget == 0 else 20, self.drain)